@@ -0,0 +1,135 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from tqdm import tqdm
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.scaled_raster import write_product, decode_band, is_scaled
+from common.validity import valid_pixels
+from common.preview import open_raster, preview_dir, preview_input
+
+# ============================================
+# User-defined paths (modify only these)
+# ============================================
+# Variable -> monthly input folder, reducer, annual output folder and file name
+# Output names are the ones read by 2_x / 3_x
+composites = {
+    'NDVI': {
+        'input_dir': r"D:\your_project\data\monthly\NDVI",
+        'reducer': 'growing_season_mean',
+        'output_dir': r"D:\your_project\data\NDVI_cleaned",
+        'output_name': '{year}_NDVI_cleaned.tif'
+    },
+    'PR': {
+        'input_dir': r"D:\your_project\data\monthly\TerraClimate_pr",
+        'reducer': 'sum',
+        'output_dir': r"D:\project\data\Drivers\Precipitation",
+        'output_name': '{year}_TerraClimate_pr.tif_remove.tif'
+    },
+    'TEMP': {
+        'input_dir': r"D:\your_project\data\monthly\TerraClimate_AvgTemp",
+        'reducer': 'mean',
+        'output_dir': r"D:\project\data\Drivers\Temperature",
+        'output_name': '{year}_TerraClimate_AvgTemp.tif_remove.tif'
+    },
+    'SOIL': {
+        'input_dir': r"D:\your_project\data\monthly\TerraClimate_soil",
+        'reducer': 'mean',
+        'output_dir': r"D:\project\data\Drivers\SoilMoisture",
+        'output_name': '{year}_TerraClimate_soil.tif_remove.tif'
+    }
+}
+
+years = range(2000, 2024)
+growing_season = range(4, 11)   # April-October
+min_valid_months = 9            # Fewer valid months in the reduced window -> nodata
+max_workers = 4                 # Years composited concurrently; each holds a few full-size layers
+
+# Year and month in monthly file names, e.g. "TerraClimate_pr_2000_01.tif" or "NDVI_200001.tif"
+month_pattern = re.compile(r'(?P<year>(?:19|20)\d{2})[_\-.]?(?P<month>0[1-9]|1[0-2])(?!\d)')
+
+REDUCERS = ('mean', 'sum', 'max', 'growing_season_mean')
+
+# ============================================
+# Discover monthly rasters: {year: {month: path}}
+# ============================================
+def monthly_files(folder):
+    found = {}
+    for f in sorted(os.listdir(folder)):
+        if not f.endswith('.tif'):
+            continue
+        match = month_pattern.search(f)
+        if match:
+            found.setdefault(int(match.group('year')), {})[int(match.group('month'))] = os.path.join(folder, f)
+    return found
+
+# ============================================
+# Stream one year's months through a reducer
+# ============================================
+def composite_year(var, spec, year, months):
+    """
+    Fold the months one at a time into running sum/count/max accumulators, so
+    only one monthly layer is held in memory. 'sum' is rescaled by
+    (months in window / valid months) so partly missing years stay comparable.
+    """
+    reducer = spec['reducer']
+    window = list(growing_season) if reducer == 'growing_season_mean' else list(range(1, 13))
+
+    total = count = peak = None
+    profile = None
+    for month in window:
+        if month not in months:
+            continue
+        with open_raster(months[month]) as src:
+            data = decode_band(src, src.read(1)).astype(np.float32)
+            valid = valid_pixels(data, None if is_scaled(src) else src.nodata)
+            if profile is None:
+                profile = {'height': src.height, 'width': src.width, 'crs': src.crs, 'transform': src.transform}
+                total = np.zeros(data.shape, dtype=np.float64)
+                count = np.zeros(data.shape, dtype=np.int16)
+                peak = np.full(data.shape, -np.inf, dtype=np.float32)
+            elif data.shape != total.shape:
+                raise ValueError(f"{months[month]} is not on the grid of the other {var} months of {year}.")
+
+        total += np.where(valid, data, 0)
+        count += valid
+        np.maximum(peak, np.where(valid, data, -np.inf), out=peak)
+
+    if profile is None:
+        return year, 0
+
+    enough = count >= min(min_valid_months, len(window))
+    annual = np.full(total.shape, np.nan, dtype=np.float32)
+    if reducer == 'max':
+        annual[enough] = peak[enough]
+    elif reducer == 'sum':
+        annual[enough] = total[enough] * len(window) / count[enough]
+    else:
+        annual[enough] = total[enough] / count[enough]
+
+    write_product(os.path.join(spec['output_dir'], spec['output_name'].format(year=year)), annual, profile)
+    return year, int(count.max())
+
+# ============================================
+# Composite every variable, years in parallel
+# ============================================
+for var, spec in composites.items():
+    if spec['reducer'] not in REDUCERS:
+        raise ValueError(f"{var}: unknown reducer '{spec['reducer']}', expected one of {REDUCERS}.")
+    spec = dict(spec, input_dir=preview_input(spec['input_dir']), output_dir=preview_dir(spec['output_dir']))
+    os.makedirs(spec['output_dir'], exist_ok=True)
+
+    available = monthly_files(spec['input_dir'])
+    missing = [y for y in years if y not in available]
+    if missing:
+        print(f"⚠️ {var}: no monthly rasters for {missing}")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(composite_year, var, spec, y, available[y]) for y in years if y in available]
+        for future in tqdm(futures, desc=f"Compositing {var} ({spec['reducer']})"):
+            year, n_months = future.result()
+            if n_months == 0:
+                print(f"⚠️ {var} {year}: no monthly rasters in the reducer window")
+
+print("✅ Monthly-to-annual compositing completed.")
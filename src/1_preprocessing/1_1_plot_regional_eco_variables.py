@@ -2,6 +2,7 @@ import pandas as pd
 import matplotlib.pyplot as plt
 
 # Define file paths (replace with actual paths as needed)
+# Tables are generated from the yearly rasters by 1_6_build_regional_statistics.py
 north_path = r'path_to_data/Northern_Xinjiang_Statistics.csv'
 south_path = r'path_to_data/Southern_Xinjiang_Statistics.csv'
 east_path  = r'path_to_data/Eastern_Xinjiang_Statistics.csv'
@@ -5,6 +5,10 @@ import rasterio.features
 import fiona
 from shapely.geometry import shape
 from tqdm import tqdm
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.validity import valid_pixels
+from common.preview import open_raster, preview_paths
 
 # =============================================
 # Configurable Paths (Edit only these)
@@ -15,6 +19,15 @@ shapefile_dir = r"D:\your_project\shapefiles\boundary"
 block_rows = 17
 block_cols = 17
 
+# Fill mode: 'block'  -> mean of the fixed block_rows x block_cols grid cell
+#            'window' -> mean of the valid pixels in a centered (2r+1)^2 window,
+#                        doubling r from window_radius up to max_window_radius
+#                        until the window holds at least one valid pixel
+fill_mode = 'block'
+window_radius = 3
+max_window_radius = 192
+input_root, output_root = preview_paths(input_root, output=output_root)
+
 # =============================================
 # Load boundary geometry (e.g., Xinjiang)
 # =============================================
@@ -37,6 +50,37 @@ for root, _, files in os.walk(input_root):
 
 os.makedirs(output_root, exist_ok=True)
 
+# =============================================
+# Moving-window fill from summed-area tables
+# =============================================
+def summed_area_table(array):
+    """Integral image with a leading zero row/column, so any box sum takes four lookups."""
+    sat = np.zeros((array.shape[0] + 1, array.shape[1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(array, axis=0, dtype=np.float64), axis=1, out=sat[1:, 1:])
+    return sat
+
+def box_sum(sat, rows, cols, radius):
+    height, width = sat.shape[0] - 1, sat.shape[1] - 1
+    r0, r1 = np.maximum(rows - radius, 0), np.minimum(rows + radius + 1, height)
+    c0, c1 = np.maximum(cols - radius, 0), np.minimum(cols + radius + 1, width)
+    return sat[r1, c1] - sat[r0, c1] - sat[r1, c0] + sat[r0, c0]
+
+def window_fill(data, valid_mask, replace_mask, fallback):
+    value_sat = summed_area_table(np.where(valid_mask, data, 0))
+    count_sat = summed_area_table(valid_mask)
+
+    filled = np.copy(data)
+    rows, cols = np.where(replace_mask)
+    radius = window_radius
+    while rows.size and radius <= max_window_radius:
+        counts = box_sum(count_sat, rows, cols, radius)
+        found = counts > 0
+        filled[rows[found], cols[found]] = box_sum(value_sat, rows[found], cols[found], radius) / counts[found]
+        rows, cols = rows[~found], cols[~found]
+        radius *= 2
+    filled[rows, cols] = fallback  # No valid pixel within max_window_radius
+    return filled
+
 # =============================================
 # Batch process each GeoTIFF file
 # =============================================
@@ -47,7 +91,7 @@ for tif_path in tqdm(tif_files, desc="Processing rasters", unit="file"):
     os.makedirs(output_dir, exist_ok=True)
     output_path = os.path.join(output_dir, f"{filename}_filled.tif")
 
-    with rasterio.open(tif_path) as src:
+    with open_raster(tif_path) as src:
         data = src.read(1).astype(np.float32)
         transform = src.transform
         nodata = src.nodata
@@ -66,40 +110,35 @@ for tif_path in tqdm(tif_files, desc="Processing rasters", unit="file"):
     if 'CLCD' in filename.upper():
         data = np.clip(data, 1, 9)
 
-    # Identify invalid (blank) pixels
-    def is_blank(x):
-        if nodata is not None:
-            return np.isnan(x) or (x == nodata) or (x < -1e30)
-        else:
-            return np.isnan(x) or (x < -1e30)
-
-    blank_mask = np.vectorize(is_blank)(data)
+    # Identify invalid (blank) pixels with the shared validity rule
+    blank_mask = ~valid_pixels(data, nodata)
     replace_mask = (shp_mask == 1) & (blank_mask == 1)
     valid_mask = (shp_mask == 1) & (~blank_mask)
     global_mean = np.nanmean(data[valid_mask]) if np.any(valid_mask) else 0
 
-    # Compute local means by block
-    local_mean_map = np.full((block_rows, block_cols), np.nan)
-    bh, bw = height // block_rows, width // block_cols
-
-    for i in range(block_rows):
-        for j in range(block_cols):
-            row_start = i * bh
-            row_end = (i + 1) * bh if i < block_rows - 1 else height
-            col_start = j * bw
-            col_end = (j + 1) * bw if j < block_cols - 1 else width
-
-            block_data = data[row_start:row_end, col_start:col_end]
-            block_mask = (shp_mask[row_start:row_end, col_start:col_end] == 1) & (~np.isnan(block_data)) & (block_data > -1e30)
-            local_mean_map[i, j] = np.nanmean(block_data[block_mask]) if np.any(block_mask) else global_mean
-
-    # Replace missing values by corresponding block average
-    filled_data = np.copy(data)
-    rows, cols = np.where(replace_mask)
-    for r, c in zip(rows, cols):
-        bi = min(r // bh, block_rows - 1)
-        bj = min(c // bw, block_cols - 1)
-        filled_data[r, c] = local_mean_map[bi, bj]
+    if fill_mode == 'window':
+        filled_data = window_fill(data, valid_mask, replace_mask, global_mean)
+    else:
+        # Compute local means by block
+        local_mean_map = np.full((block_rows, block_cols), np.nan)
+        bh, bw = height // block_rows, width // block_cols
+
+        for i in range(block_rows):
+            for j in range(block_cols):
+                row_start = i * bh
+                row_end = (i + 1) * bh if i < block_rows - 1 else height
+                col_start = j * bw
+                col_end = (j + 1) * bw if j < block_cols - 1 else width
+
+                block_data = data[row_start:row_end, col_start:col_end]
+                block_mask = valid_mask[row_start:row_end, col_start:col_end]
+                local_mean_map[i, j] = np.nanmean(block_data[block_mask]) if np.any(block_mask) else global_mean
+
+        # Replace missing values by corresponding block average
+        filled_data = np.copy(data)
+        rows, cols = np.where(replace_mask)
+        filled_data[rows, cols] = local_mean_map[np.minimum(rows // bh, block_rows - 1),
+                                                 np.minimum(cols // bw, block_cols - 1)]
 
     # Final postprocessing
     filled_data = np.where(
@@ -113,7 +152,7 @@ for tif_path in tqdm(tif_files, desc="Processing rasters", unit="file"):
         filled_data = np.clip(filled_data, 0, None)
 
     # Save final raster
-    with rasterio.open(tif_path) as src:
+    with open_raster(tif_path) as src:
         meta = src.meta.copy()
 
     meta.update(dtype='float32', nodata=-9999)
@@ -0,0 +1,136 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import rasterio
+import rasterio.features
+import geopandas as gpd
+from tqdm import tqdm
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.validity import valid_pixels
+from common.preview import open_raster, preview_paths
+
+# ============================================
+# User-defined paths (modify only these)
+# ============================================
+data_root = r"D:\your_project\data\filled"
+output_dir = r"D:\your_project\data\region_statistics"
+
+# Subregion shapefiles -> output table read by 1_1_plot_regional_eco_variables.py
+region_shapefiles = {
+    'Northern_Xinjiang': r"D:\your_project\shapefiles\north_region.shp",
+    'Southern_Xinjiang': r"D:\your_project\shapefiles\south_region.shp",
+    'Eastern_Xinjiang': r"D:\your_project\shapefiles\east_region.shp"
+}
+
+# Variable -> (subfolder, filename pattern); column order matches 1_1
+variables = {
+    'ET': ('filled_ET', '{year}_ET_filled.tif'),
+    'GPP': ('filled_GPP', '{year}_GPP_filled.tif'),
+    'MODIS_NDVI': ('filled_NDVI', '{year}_NDVI_filled.tif'),
+    'Nightlight': ('filled_Nightlight', 'Nightlight_{year}_filled.tif'),
+    'PR': ('filled_PR', '{year}_PR_filled.tif'),
+    'SOIL': ('filled_SOIL', '{year}_SOIL_filled.tif'),
+    'TEMP': ('filled_TEMP', '{year}_TEMP_filled.tif')
+}
+
+years = range(2000, 2024)
+percentiles = []        # e.g. [10, 50, 90]; written to *_Percentiles.csv when non-empty
+max_workers = 8         # Concurrent raster reads
+
+data_root, output_dir = preview_paths(data_root, output=output_dir)
+os.makedirs(output_dir, exist_ok=True)
+
+# ============================================
+# Load region geometries
+# ============================================
+region_names = list(region_shapefiles)
+region_gdfs = {name: gpd.read_file(path) for name, path in region_shapefiles.items()}
+
+# ============================================
+# Rasterize the subregions once per grid
+# ============================================
+_label_cache = {}
+_label_lock = threading.Lock()
+
+def region_labels(transform, shape, crs):
+    """Label grid with 1..N for the subregions and 0 outside; cached per grid."""
+    key = (tuple(transform), shape)
+    with _label_lock:
+        if key not in _label_cache:
+            shapes = []
+            for label, name in enumerate(region_names, start=1):
+                gdf = region_gdfs[name]
+                if crs is not None and gdf.crs is not None and gdf.crs != crs:
+                    gdf = gdf.to_crs(crs)
+                shapes.extend((geom, label) for geom in gdf.geometry.values)
+            _label_cache[key] = rasterio.features.rasterize(
+                shapes, out_shape=shape, transform=transform, fill=0, dtype='uint8'
+            )
+        return _label_cache[key]
+
+# ============================================
+# Per variable-year regional statistics
+# ============================================
+def region_statistics(var, year):
+    subfolder, pattern = variables[var]
+    path = os.path.join(data_root, subfolder, pattern.format(year=year))
+
+    with open_raster(path) as src:
+        data = src.read(1).astype(np.float64)
+        labels = region_labels(src.transform, data.shape, src.crs)
+        nodata = src.nodata
+
+    valid = (labels > 0) & valid_pixels(data, nodata)
+
+    n_regions = len(region_names) + 1
+    sums = np.bincount(labels[valid], weights=data[valid], minlength=n_regions)
+    counts = np.bincount(labels[valid], minlength=n_regions)
+    means = np.divide(sums, counts, out=np.full(n_regions, np.nan), where=counts > 0)
+
+    result = {'mean': means[1:]}
+    if percentiles:
+        lab = labels[valid]
+        order = np.argsort(lab, kind='stable')
+        values = data[valid][order]
+        bounds = np.searchsorted(lab[order], np.arange(1, n_regions + 1))
+        result['percentiles'] = [
+            np.percentile(values[bounds[r]:bounds[r + 1]], percentiles)
+            if bounds[r + 1] > bounds[r] else np.full(len(percentiles), np.nan)
+            for r in range(n_regions - 1)
+        ]
+    return var, year, result
+
+# ============================================
+# Stream all variable-years in parallel
+# ============================================
+tasks = [(var, year) for var in variables for year in years]
+means = {name: pd.DataFrame(index=list(years), columns=list(variables), dtype=float) for name in region_names}
+percentile_rows = []
+
+with ThreadPoolExecutor(max_workers=max_workers) as pool:
+    futures = [pool.submit(region_statistics, var, year) for var, year in tasks]
+    for future in tqdm(futures, desc="Regional statistics", unit="raster"):
+        var, year, result = future.result()
+        for r, name in enumerate(region_names):
+            means[name].loc[year, var] = result['mean'][r]
+            if percentiles:
+                row = {'Region': name, 'Year': year, 'Variable': var}
+                row.update({f'P{q}': v for q, v in zip(percentiles, result['percentiles'][r])})
+                percentile_rows.append(row)
+
+# ============================================
+# Write tables in the layout read by 1_1
+# ============================================
+for name, df in means.items():
+    df.index.name = 'Year'
+    df.reset_index().to_csv(os.path.join(output_dir, f"{name}_Statistics.csv"), index=False)
+
+if percentiles:
+    percentile_df = pd.DataFrame(percentile_rows).sort_values(['Region', 'Variable', 'Year'])
+    for name, df in percentile_df.groupby('Region'):
+        df.drop(columns='Region').to_csv(os.path.join(output_dir, f"{name}_Percentiles.csv"), index=False)
+
+print(f"✅ Regional statistics tables saved in: {output_dir}")
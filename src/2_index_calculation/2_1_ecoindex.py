@@ -1,9 +1,13 @@
 import os
 import numpy as np
-import rasterio
-from rasterio.mask import mask
 import fiona
 from sklearn.decomposition import PCA
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.scaled_raster import write_product
+from common.validity import load_or_build_validity
+from common.prefetch import Prefetcher
+from common.preview import open_raster, preview_paths
 
 # ============================================================
 # Configurable Paths (replace with your actual project folders)
@@ -12,7 +16,10 @@ ndvi_dir = r"D:\your_project\data\NDVI_cleaned"
 wue_dir = r"D:\your_project\data\WUE_cleaned"
 output_dir = r"D:\your_project\results\EcoIndex_PCA"
 shapefile_path = r"D:\your_project\shapefiles\region_boundary.shp"
+storage_format = 'float32'  # 'float32' or 'scaled' (int16 with scale/offset metadata)
+prefetch_depth = 3          # Yearly rasters decoded ahead on a thread pool
 
+ndvi_dir, wue_dir, output_dir = preview_paths(ndvi_dir, wue_dir, output=output_dir)
 os.makedirs(output_dir, exist_ok=True)
 
 # ============================================================
@@ -25,28 +32,40 @@ with fiona.open(shapefile_path, "r") as shapefile:
 # Read yearly NDVI and WUE raster files
 # ============================================================
 years = range(2000, 2024)
+ndvi_paths = [os.path.join(ndvi_dir, f"{year}_NDVI_cleaned.tif") for year in years]
+wue_paths = [os.path.join(wue_dir, f"{year}_WUE_cleaned.tif") for year in years]
+
+# Shared per-pixel-year validity (nodata + study area), built once per variable
+ndvi_validity = load_or_build_validity(os.path.join(ndvi_dir, "NDVI_validity.npz"), ndvi_paths, years, shapes)
+wue_validity = load_or_build_validity(os.path.join(wue_dir, "WUE_validity.npz"), wue_paths, years, shapes)
+data_valid = ndvi_validity.stack() & wue_validity.stack()
+
 ndvi_list = []
 wue_list = []
 
-for year in years:
-    ndvi_path = os.path.join(ndvi_dir, f"{year}_NDVI_cleaned.tif")
-    wue_path = os.path.join(wue_dir, f"{year}_WUE_cleaned.tif")
-
-    with rasterio.open(ndvi_path) as src_ndvi:
-        ndvi_data, _ = mask(src_ndvi, shapes, crop=False, filled=True, nodata=np.nan)
-    with rasterio.open(wue_path) as src_wue:
-        wue_data, _ = mask(src_wue, shapes, crop=False, filled=True, nodata=np.nan)
+def read_pair(paths):
+    ndvi_path, wue_path = paths
+    with open_raster(ndvi_path) as src_ndvi:
+        ndvi = src_ndvi.read(1).astype(np.float32)
+    with open_raster(wue_path) as src_wue:
+        wue = src_wue.read(1).astype(np.float32)
+    return ndvi, wue
 
-    ndvi_list.append(ndvi_data.squeeze())
-    wue_list.append(wue_data.squeeze())
+reader = Prefetcher(list(zip(ndvi_paths, wue_paths)), read_pair, depth=prefetch_depth, label="NDVI/WUE reads")
+for ndvi, wue in reader:
+    ndvi_list.append(ndvi)
+    wue_list.append(wue)
+reader.report()
 
 ndvi_stack = np.stack(ndvi_list)  # shape: (years, height, width)
 wue_stack = np.stack(wue_list)
+ndvi_stack[~data_valid] = np.nan
+wue_stack[~data_valid] = np.nan
 
 # ============================================================
 # Normalize within valid region
 # ============================================================
-valid_mask = (~np.isnan(ndvi_stack)) & (~np.isnan(wue_stack)) & (ndvi_stack > 0) & (wue_stack > 0)
+valid_mask = data_valid & (ndvi_stack > 0) & (wue_stack > 0)
 ndvi_valid = ndvi_stack[valid_mask]
 wue_valid = wue_stack[valid_mask]
 
@@ -78,27 +97,23 @@ for idx, year in enumerate(years):
     wue_img = wue_norm[idx]
 
     ecoindex = np.full(ndvi_img.shape, np.nan, dtype=np.float32)
-    valid_pixels = (~np.isnan(ndvi_img)) & (~np.isnan(wue_img)) & (ndvi_img > -999) & (wue_img > -999)
+    valid_pixels = data_valid[idx]
     ecoindex[valid_pixels] = coeff_ndvi * ndvi_img[valid_pixels] + coeff_wue * wue_img[valid_pixels]
 
     # Read metadata from reference NDVI raster
     ref_path = os.path.join(ndvi_dir, f"{year}_NDVI_cleaned.tif")
-    with rasterio.open(ref_path) as src:
+    with open_raster(ref_path) as src:
         meta = src.meta.copy()
         meta.update({
             "driver": "GTiff",
             "height": ecoindex.shape[0],
             "width": ecoindex.shape[1],
             "transform": src.transform,
-            "crs": src.crs,
-            "count": 1,
-            "dtype": "float32",
-            "nodata": np.nan
+            "crs": src.crs
         })
 
     # Save output
     output_path = os.path.join(output_dir, f"{year}_EcoIndex.tif")
-    with rasterio.open(output_path, "w", **meta) as dst:
-        dst.write(ecoindex, 1)
+    write_product(output_path, ecoindex, meta, encoding='EcoIndex' if storage_format == 'scaled' else None)
 
 print("✅ All annual EcoIndex maps generated successfully.")
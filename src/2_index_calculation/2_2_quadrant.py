@@ -1,9 +1,13 @@
 import os
 import numpy as np
 import rasterio
-import rasterio.mask
 import geopandas as gpd
 from tqdm import tqdm
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.validity import load_or_build_validity
+from common.prefetch import Prefetcher
+from common.preview import open_raster, preview_paths
 
 # ==========================================
 # Define data directories (customize here)
@@ -12,7 +16,9 @@ ndvi_dir = r"D:\your_project\data\NDVI_cleaned"
 wue_dir = r"D:\your_project\data\WUE_cleaned"
 output_dir = r"D:\your_project\results\quadrant_classification"
 shapefile_path = r"D:\your_project\shapefiles\region_boundary.shp"
+prefetch_depth = 3  # Yearly rasters decoded ahead on a thread pool
 
+ndvi_dir, wue_dir, output_dir = preview_paths(ndvi_dir, wue_dir, output=output_dir)
 os.makedirs(output_dir, exist_ok=True)
 
 # ==========================================
@@ -44,29 +50,44 @@ def classify_quadrants(delta_wue, delta_ndvi):
 # ==========================================
 years = list(range(2000, 2023))  # Exclude final year to compare with next
 
-for year in tqdm(years, desc="Quadrant classification"):
-    next_year = year + 1
+# Shared per-pixel-year validity (nodata + study area), built once per variable
+all_years = years + [years[-1] + 1]
+ndvi_validity = load_or_build_validity(
+    os.path.join(ndvi_dir, "NDVI_validity.npz"),
+    [os.path.join(ndvi_dir, f"{y}_NDVI_cleaned.tif") for y in all_years], all_years, geoms
+)
+wue_validity = load_or_build_validity(
+    os.path.join(wue_dir, "WUE_validity.npz"),
+    [os.path.join(wue_dir, f"{y}_WUE_cleaned.tif") for y in all_years], all_years, geoms
+)
 
-    ndvi_path1 = os.path.join(ndvi_dir, f"{year}_NDVI_cleaned.tif")
-    ndvi_path2 = os.path.join(ndvi_dir, f"{next_year}_NDVI_cleaned.tif")
-    wue_path1 = os.path.join(wue_dir, f"{year}_WUE_cleaned.tif")
-    wue_path2 = os.path.join(wue_dir, f"{next_year}_WUE_cleaned.tif")
+def read_year(year):
+    with open_raster(os.path.join(ndvi_dir, f"{year}_NDVI_cleaned.tif")) as src:
+        ndvi = src.read(1).astype(np.float32)
+        meta = src.meta.copy()
+    with open_raster(os.path.join(wue_dir, f"{year}_WUE_cleaned.tif")) as src:
+        wue = src.read(1).astype(np.float32)
+    return ndvi, wue, meta
 
-    with rasterio.open(ndvi_path1) as src1, rasterio.open(ndvi_path2) as src2:
-        ndvi1, _ = rasterio.mask.mask(src1, geoms, crop=False)
-        ndvi2, _ = rasterio.mask.mask(src2, geoms, crop=False)
-        meta = src1.meta.copy()
+# Each year is read once (prefetched) and reused as the start of the next pair
+reader = Prefetcher(all_years, read_year, depth=prefetch_depth, label="Quadrant reads")
+previous = None
 
-    with rasterio.open(wue_path1) as src1, rasterio.open(wue_path2) as src2:
-        wue1, _ = rasterio.mask.mask(src1, geoms, crop=False)
-        wue2, _ = rasterio.mask.mask(src2, geoms, crop=False)
+for t, (ndvi2, wue2, meta2) in enumerate(tqdm(reader, desc="Quadrant classification")):
+    if previous is None:
+        previous = (ndvi2, wue2, meta2)
+        continue
+    ndvi1, wue1, meta = previous
+    previous = (ndvi2, wue2, meta2)
+    next_year = all_years[t]
 
     # Calculate yearly differences
-    delta_ndvi = ndvi2[0] - ndvi1[0]
-    delta_wue = wue2[0] - wue1[0]
+    delta_ndvi = ndvi2 - ndvi1
+    delta_wue = wue2 - wue1
 
     # Apply valid pixel mask
-    valid_mask = (~np.isnan(delta_ndvi)) & (~np.isnan(delta_wue))
+    valid_mask = (ndvi_validity.year(t - 1) & ndvi_validity.year(t)
+                  & wue_validity.year(t - 1) & wue_validity.year(t))
     delta_ndvi[~valid_mask] = np.nan
     delta_wue[~valid_mask] = np.nan
 
@@ -85,4 +106,5 @@ for year in tqdm(years, desc="Quadrant classification"):
     with rasterio.open(save_path, "w", **meta) as dst:
         dst.write(quadrant_map, 1)
 
+reader.report()
 print("✅ All quadrant classification maps generated successfully.")
@@ -1,9 +1,13 @@
 import os
 import numpy as np
-import rasterio
-from rasterio.mask import mask
 import geopandas as gpd
 from tqdm import tqdm
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.scaled_raster import write_product
+from common.validity import load_or_build_validity
+from common.prefetch import Prefetcher
+from common.preview import open_raster, preview_paths
 
 # ==========================================
 # Define input/output paths (customize here)
@@ -12,7 +16,10 @@ ndvi_dir = r"D:\your_project\data\NDVI_cleaned"
 wue_dir = r"D:\your_project\data\WUE_cleaned"
 output_dir = r"D:\your_project\results\ESI"
 shapefile_path = r"D:\your_project\shapefiles\study_region.shp"
+storage_format = 'float32'  # 'float32' or 'scaled' (uint16 with scale/offset metadata)
+prefetch_depth = 3          # Yearly rasters decoded ahead on a thread pool
 
+ndvi_dir, wue_dir, output_dir = preview_paths(ndvi_dir, wue_dir, output=output_dir)
 os.makedirs(output_dir, exist_ok=True)
 
 # ==========================================
@@ -24,24 +31,32 @@ shapefile = gpd.read_file(shapefile_path)
 # Collect annual NDVI and WUE data
 # ==========================================
 years = list(range(2000, 2024))
+ndvi_paths = [os.path.join(ndvi_dir, f"{year}_NDVI_cleaned.tif") for year in years]
+wue_paths = [os.path.join(wue_dir, f"{year}_WUE_cleaned.tif") for year in years]
+
+# Shared per-pixel-year validity (nodata + study area), built once per variable
+geoms = shapefile.geometry.values
+ndvi_validity = load_or_build_validity(os.path.join(ndvi_dir, "NDVI_validity.npz"), ndvi_paths, years, geoms)
+wue_validity = load_or_build_validity(os.path.join(wue_dir, "WUE_validity.npz"), wue_paths, years, geoms)
+
 ndvi_stack = []
 wue_stack = []
 
-for year in tqdm(years, desc="Loading NDVI and WUE"):
-    ndvi_path = os.path.join(ndvi_dir, f"{year}_NDVI_cleaned.tif")
-    wue_path = os.path.join(wue_dir, f"{year}_WUE_cleaned.tif")
-
-    with rasterio.open(ndvi_path) as src_ndvi:
-        ndvi, _ = mask(src_ndvi, shapefile.geometry, crop=False)
-        ndvi = ndvi[0]
-        ndvi_meta = src_ndvi.meta.copy()
+def read_pair(paths):
+    ndvi_path, wue_path = paths
+    with open_raster(ndvi_path) as src_ndvi:
+        ndvi = src_ndvi.read(1)
+        meta = src_ndvi.meta.copy()
 
-    with rasterio.open(wue_path) as src_wue:
-        wue, _ = mask(src_wue, shapefile.geometry, crop=False)
-        wue = wue[0]
+    with open_raster(wue_path) as src_wue:
+        wue = src_wue.read(1)
+    return ndvi, wue, meta
 
+reader = Prefetcher(list(zip(ndvi_paths, wue_paths)), read_pair, depth=prefetch_depth, label="NDVI/WUE reads")
+for ndvi, wue, ndvi_meta in tqdm(reader, desc="Loading NDVI and WUE"):
     ndvi_stack.append(ndvi)
     wue_stack.append(wue)
+reader.report()
 
 # ==========================================
 # Stack into 3D arrays: [time, rows, cols]
@@ -52,7 +67,7 @@ wue_stack = np.stack(wue_stack)
 # ==========================================
 # Normalize within valid pixels only
 # ==========================================
-valid_mask = (ndvi_stack != ndvi_meta['nodata']) & (wue_stack != ndvi_meta['nodata'])
+valid_mask = ndvi_validity.stack() & wue_validity.stack()
 
 ndvi_valid = ndvi_stack[valid_mask]
 wue_valid = wue_stack[valid_mask]
@@ -82,13 +97,7 @@ for i, year in enumerate(years):
 
     # Save output
     output_path = os.path.join(output_dir, f"{year}_ESI.tif")
-    ndvi_meta.update({
-        "dtype": "float32",
-        "count": 1,
-        "nodata": ndvi_meta['nodata']
-    })
-
-    with rasterio.open(output_path, "w", **ndvi_meta) as dst:
-        dst.write(esi.astype(np.float32), 1)
+    write_product(output_path, esi, ndvi_meta, encoding='ESI' if storage_format == 'scaled' else None,
+                  nodata=ndvi_meta['nodata'])
 
 print("✅ All yearly ESI rasters generated successfully.")
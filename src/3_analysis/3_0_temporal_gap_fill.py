@@ -0,0 +1,102 @@
+import os
+import re
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+import geopandas as gpd
+from tqdm import tqdm
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.scaled_raster import open_product, write_window, decode_band
+from common.validity import load_or_build_validity
+from common.temporal_fill import fill_gaps
+from common.preview import open_raster, preview_dir, preview_input, PREVIEW_TAG
+
+# ==========================================
+# Define input/output paths (customize here)
+# ==========================================
+shapefile_path = r"D:\your_project\shapefiles\study_region.shp"
+filled_root = r"D:\your_project\data\gap_filled"   # Point 3_1 / 3_2 at the folders written here
+storage_format = 'float32'  # 'float32' or 'scaled' (EcoIndex/ESI as int16/uint16 with scale/offset metadata)
+
+# Yearly series to fill: label -> (input folder, file keyword)
+# CLCD is categorical and left unfilled
+series = {
+    'EcoIndex': (r"D:\your_project\data\EcoIndex", 'EcoIndex'),
+    'ESI': (r"D:\your_project\data\ESI", 'ESI'),
+    'PR': (r"D:\project\data\Drivers\Precipitation", 'TerraClimate_pr'),
+    'SOIL': (r"D:\project\data\Drivers\SoilMoisture", 'TerraClimate_soil'),
+    'TEMP': (r"D:\project\data\Drivers\Temperature", 'TerraClimate_AvgTemp'),
+    'NL': (r"D:\project\data\Drivers\Nightlight", 'Nightlight')
+}
+
+fill_method = 'linear'  # 'linear', 'nearest' or 'climatology'
+max_gap = 2             # Longest run of missing years that is filled
+block_rows = 64         # Rows per block; memory is about years x block_rows x width floats
+
+series = {label: (preview_input(folder), keyword) for label, (folder, keyword) in series.items()}
+filled_root = preview_dir(filled_root)
+count_dir = os.path.join(filled_root, "fill_counts")
+os.makedirs(count_dir, exist_ok=True)
+
+shapefile = gpd.read_file(shapefile_path)
+geoms = shapefile.geometry.values
+
+# ==========================================
+# Yearly files of a series (as discovered by 3_1)
+# ==========================================
+def series_files(folder, keyword):
+    files = sorted([f for f in os.listdir(folder) if keyword in f and f.endswith('.tif')])
+    return [f for f in files if 'map' not in f and 'mosaic' not in f]
+
+# ==========================================
+# Fill one series block by block along the year axis
+# ==========================================
+def fill_series(label, folder, keyword):
+    files = series_files(folder, keyword)
+    years = [int(re.search(r'(\d{4})', f).group(1)) for f in files]
+    paths = [os.path.join(folder, f) for f in files]
+    validity = load_or_build_validity(os.path.join(folder, f"{keyword}_validity.npz"), paths, years, geoms)
+
+    out_folder = os.path.join(filled_root, os.path.basename(os.path.normpath(folder)).replace(PREVIEW_TAG, ''))
+    os.makedirs(out_folder, exist_ok=True)
+    encoding = label if storage_format == 'scaled' and label in ('EcoIndex', 'ESI') else None
+
+    sources = [open_raster(p) for p in paths]
+    profile = {'height': sources[0].height, 'width': sources[0].width,
+               'crs': sources[0].crs, 'transform': sources[0].transform}
+    targets = [open_product(os.path.join(out_folder, f), profile, encoding) for f in files]
+    height, width = sources[0].shape
+    filled_years = np.zeros((height, width), dtype=np.int16)
+
+    try:
+        for r0 in tqdm(range(0, height, block_rows), desc=f"Gap-filling {label}"):
+            r1 = min(r0 + block_rows, height)
+            window = Window(0, r0, width, r1 - r0)
+            block = np.empty((len(paths), r1 - r0, width), dtype=np.float32)
+            for t, src in enumerate(sources):
+                block[t] = decode_band(src, src.read(1, window=window))
+                block[t][~validity.rows(t, r0, r1)] = np.nan
+
+            flat = block.reshape(len(paths), -1)
+            filled, count = fill_gaps(flat, fill_method, max_gap)
+            filled = filled.reshape(block.shape)
+            count[np.isnan(flat).all(axis=0)] = -1  # Never observed (e.g. outside the study area)
+            filled_years[r0:r1] = count.reshape(r1 - r0, width)
+            for t, dst in enumerate(targets):
+                write_window(dst, filled[t], encoding, window=window)
+    finally:
+        for ds in sources + targets:
+            ds.close()
+
+    count_profile = dict(profile, dtype='int16', nodata=-1)
+    count_profile.update({'driver': 'GTiff', 'count': 1})
+    with rasterio.open(os.path.join(count_dir, f"{label}_FilledYears.tif"), 'w', **count_profile) as dst:
+        dst.write(filled_years, 1)
+
+    print(f"🩹 {label}: {int(filled_years[filled_years > 0].sum())} pixel-years filled ({fill_method}, max gap {max_gap}) -> {out_folder}")
+
+for label, (folder, keyword) in series.items():
+    fill_series(label, folder, keyword)
+
+print(f"✅ Temporal gap filling completed. Output directory: {filled_root}")
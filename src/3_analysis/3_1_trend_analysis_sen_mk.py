@@ -1,10 +1,15 @@
 import os
+import re
 import numpy as np
 import rasterio
-from rasterio.mask import mask
 import geopandas as gpd
-import pymannkendall as mk
-from tqdm import tqdm
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.scaled_raster import write_product, decode_band
+from common.validity import load_or_build_validity
+from common.prefetch import Prefetcher
+from common.trend_kernels import block_trends, mk_state, mk_update, mk_pvalue
+from common.preview import open_raster, preview_paths
 
 # ===================================
 # Define input/output and mask paths
@@ -13,8 +18,19 @@ ecoindex_dir = r"D:\your_project\data\EcoIndex"
 esi_dir = r"D:\your_project\data\ESI"
 output_dir = r"D:\your_project\results\TrendMaps"
 shapefile_path = r"D:\your_project\shapefiles\study_region.shp"
+storage_format = 'float32'  # 'float32' or 'scaled' (int16/uint16 with scale/offset metadata)
+block_rows = 16             # Rows per block for the vectorized change-point / CI kernels
+slope_ci_alpha = 0.05       # Two-sided level of the Sen's slope confidence bounds
+prefetch_depth = 3          # Yearly rasters decoded ahead on a thread pool
+ecoindex_dir, esi_dir, output_dir = preview_paths(ecoindex_dir, esi_dir, output=output_dir)
+
+# 'full' recomputes every pixel over all years and saves the Mann-Kendall state;
+# 'append' only folds the years not yet in that state into it
+trend_mode = 'full'
+state_dir = os.path.join(output_dir, 'trend_state')
 
 os.makedirs(output_dir, exist_ok=True)
+os.makedirs(state_dir, exist_ok=True)
 
 # ===================================
 # Load shapefile geometries
@@ -25,88 +41,115 @@ geoms = shapefile.geometry.values
 # ===================================
 # Load multiyear raster time series
 # ===================================
-def load_raster_series(folder, keyword):
+def series_files(folder, keyword):
     files = sorted([f for f in os.listdir(folder) if keyword in f and f.endswith('.tif')])
-    files = [f for f in files if 'map' not in f and 'mosaic' not in f]  # Exclude non-yearly tiles
+    return [f for f in files if 'map' not in f and 'mosaic' not in f]  # Exclude non-yearly tiles
+
+def series_years(files):
+    return [int(re.search(r'(\d{4})', f).group(1)) for f in files]
+
+def load_raster_series(folder, keyword):
+    files = series_files(folder, keyword)
+    paths = [os.path.join(folder, f) for f in files]
+    years = series_years(files)
+    # Shared per-pixel-year validity (nodata + study area), built once per series
+    validity = load_or_build_validity(os.path.join(folder, f"{keyword}_validity.npz"), paths, years, geoms)
+
+    def read_year(t):
+        with open_raster(paths[t]) as src:
+            img = decode_band(src, src.read(1)).astype(np.float32)
+            img[~validity.year(t)] = np.nan
+            return img, src.transform, src.crs
+
     stack = []
-    for f in files:
-        with rasterio.open(os.path.join(folder, f)) as src:
-            img, _ = mask(src, geoms, crop=False)
-            stack.append(img[0])
-            transform = src.transform
-            crs = src.crs
-    return np.array(stack), transform, crs
-
-eco_stack, transform, crs = load_raster_series(ecoindex_dir, 'EcoIndex')
-esi_stack, _, _ = load_raster_series(esi_dir, 'ESI')
-years = np.arange(2000, 2024)
+    reader = Prefetcher(list(range(len(paths))), read_year, depth=prefetch_depth, label=f"{keyword} reads")
+    for img, transform, crs in reader:
+        stack.append(img)
+    reader.report()
+    return np.array(stack), np.array(years), transform, crs
 
-# ===================================
-# Calculate Sen's slope
-# ===================================
-def compute_sen_slope(ts):
-    ts = np.array(ts)
-    valid = ~np.isnan(ts)
-    if np.sum(valid) < 2:
-        return np.nan
-    slopes = [(ts[j] - ts[i]) / (years[j] - years[i])
-              for i in range(len(ts)) for j in range(i + 1, len(ts))
-              if valid[i] and valid[j]]
-    return np.median(slopes) if slopes else np.nan
+# Each series keeps its own years: in append mode one may already hold a year the other lacks
+eco_stack, eco_years, transform, crs = load_raster_series(ecoindex_dir, 'EcoIndex')
+esi_stack, esi_years, _, _ = load_raster_series(esi_dir, 'ESI')
 
 # ===================================
-# Calculate Mann-Kendall p-value
+# Sen's slope, its CI and Pettitt change points (vectorized per row block)
 # ===================================
-def compute_mk_pvalue(ts):
-    ts = np.array(ts)
-    valid = ~np.isnan(ts)
-    if np.sum(valid) < 6:
-        return np.nan
-    result = mk.original_test(ts[valid])
-    return result.p
+def change_point_and_ci(data_stack, years, label, pixel_mask=None):
+    slope, lower, upper, change_year, change_p = block_trends(
+        data_stack, years, block_rows=block_rows, alpha=slope_ci_alpha, pixel_mask=pixel_mask,
+        desc=f"Trends {label}")
+    return slope, change_year, change_p, lower, upper
 
 # ===================================
-# Apply trend analysis to each pixel
+# Incremental Mann-Kendall state (S, tie term, valid-year count)
 # ===================================
-def trend_analysis(data_stack, label):
-    height, width = data_stack.shape[1:]
-    sen_slope = np.full((height, width), np.nan)
-    mk_pvalue = np.full((height, width), np.nan)
+def state_path(label):
+    return os.path.join(state_dir, f'{label}_mk_state.npz')
+
+def save_mk_state(label, years, s, tie_term, n):
+    np.savez_compressed(state_path(label), s=s, tie_term=tie_term, n=n, years=years)
+
+def read_previous(label, suffix):
+    with rasterio.open(os.path.join(output_dir, f'{label}_{suffix}.tif')) as src:
+        return decode_band(src, src.read(1)).astype(np.float32)
+
+def append_years(data_stack, years, label):
+    """
+    Fold the years missing from the saved state into S and the tie term (O(N) per
+    pixel and appended year), refresh the p-values, and recompute Sen's slope,
+    its bounds and the change point exactly only where a new year is valid.
+    """
+    state = np.load(state_path(label))
+    s, tie_term, n = state['s'], state['tie_term'], state['n']
+    done = len(state['years'])
+    if list(state['years']) != list(years[:done]):
+        raise ValueError(f"{label}: saved trend state years do not prefix the current series.")
 
-    for i in tqdm(range(height), desc=f"Analyzing {label}"):
-        for j in range(width):
-            ts = data_stack[:, i, j]
-            if np.all(np.isnan(ts)):
-                continue
-            sen_slope[i, j] = compute_sen_slope(ts)
-            mk_pvalue[i, j] = compute_mk_pvalue(ts)
+    changed = np.zeros(data_stack.shape[1:], dtype=bool)
+    for t in range(done, len(years)):
+        mk_update(s, tie_term, n, data_stack[t], data_stack[:t])
+        changed |= ~np.isnan(data_stack[t])
+    save_mk_state(label, years, s, tie_term, n)
 
-    return sen_slope, mk_pvalue
+    results = list(change_point_and_ci(data_stack, years, label, pixel_mask=changed))
+    for k, suffix in enumerate(['SenSlope', 'ChangeYear', 'Change_pvalue', 'SenSlope_Lower', 'SenSlope_Upper']):
+        results[k] = np.where(changed, results[k], read_previous(label, suffix))
+    sen, cp, cp_p, lo, hi = results
+    return sen, mk_pvalue(s, tie_term, n), cp, cp_p, lo, hi
 
-eco_sen, eco_p = trend_analysis(eco_stack, "EcoIndex")
-esi_sen, esi_p = trend_analysis(esi_stack, "ESI")
+def full_run(data_stack, years, label):
+    sen, cp, cp_p, lo, hi = change_point_and_ci(data_stack, years, label)
+    state = mk_state(data_stack)
+    save_mk_state(label, years, *state)
+    return sen, mk_pvalue(*state), cp, cp_p, lo, hi
+
+run = append_years if trend_mode == 'append' else full_run
+eco_sen, eco_p, eco_cp, eco_cp_p, eco_lo, eco_hi = run(eco_stack, eco_years, "EcoIndex")
+esi_sen, esi_p, esi_cp, esi_cp_p, esi_lo, esi_hi = run(esi_stack, esi_years, "ESI")
 
 # ===================================
 # Save trend raster outputs
 # ===================================
-def save_raster(array, path, transform, crs, dtype='float32'):
-    with rasterio.open(
-        path,
-        'w',
-        driver='GTiff',
-        height=array.shape[0],
-        width=array.shape[1],
-        count=1,
-        dtype=dtype,
-        crs=crs,
-        transform=transform,
-        nodata=np.nan
-    ) as dst:
-        dst.write(array.astype(dtype), 1)
-
-save_raster(eco_sen, os.path.join(output_dir, 'EcoIndex_SenSlope.tif'), transform, crs)
-save_raster(eco_p, os.path.join(output_dir, 'EcoIndex_MK_pvalue.tif'), transform, crs)
-save_raster(esi_sen, os.path.join(output_dir, 'ESI_SenSlope.tif'), transform, crs)
-save_raster(esi_p, os.path.join(output_dir, 'ESI_MK_pvalue.tif'), transform, crs)
+def save_raster(array, path, transform, crs, encoding=None):
+    profile = {
+        'height': array.shape[0],
+        'width': array.shape[1],
+        'crs': crs,
+        'transform': transform
+    }
+    write_product(path, array, profile, encoding=encoding if storage_format == 'scaled' else None)
+
+save_raster(eco_sen, os.path.join(output_dir, 'EcoIndex_SenSlope.tif'), transform, crs, encoding='EcoIndex_SenSlope')
+save_raster(eco_p, os.path.join(output_dir, 'EcoIndex_MK_pvalue.tif'), transform, crs, encoding='pvalue')
+save_raster(esi_sen, os.path.join(output_dir, 'ESI_SenSlope.tif'), transform, crs, encoding='ESI_SenSlope')
+save_raster(esi_p, os.path.join(output_dir, 'ESI_MK_pvalue.tif'), transform, crs, encoding='pvalue')
+
+for label, cp, cp_p, lo, hi in (("EcoIndex", eco_cp, eco_cp_p, eco_lo, eco_hi),
+                                ("ESI", esi_cp, esi_cp_p, esi_lo, esi_hi)):
+    save_raster(cp, os.path.join(output_dir, f'{label}_ChangeYear.tif'), transform, crs, encoding='year')
+    save_raster(cp_p, os.path.join(output_dir, f'{label}_Change_pvalue.tif'), transform, crs, encoding='pvalue')
+    save_raster(lo, os.path.join(output_dir, f'{label}_SenSlope_Lower.tif'), transform, crs, encoding=f'{label}_SenSlope')
+    save_raster(hi, os.path.join(output_dir, f'{label}_SenSlope_Upper.tif'), transform, crs, encoding=f'{label}_SenSlope')
 
 print("✅ Trend analysis completed and results saved.")
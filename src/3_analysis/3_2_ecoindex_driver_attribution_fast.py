@@ -1,11 +1,31 @@
 import os
+import json
+import hashlib
+import tempfile
+import threading
 import numpy as np
 import rasterio
 from rasterio.enums import Resampling
+from rasterio.transform import Affine
+from rasterio.crs import CRS
 from rasterio.mask import mask
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+import rasterio.windows
+import rasterio.features
 import geopandas as gpd
 from sklearn.ensemble import RandomForestRegressor
 from tqdm import tqdm
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.scaled_raster import write_product, open_product, write_window, decode_band, is_scaled
+from common.validity import valid_pixels, geometry_key
+from common.prefetch import Prefetcher
+from common.paths import driver_path
+from common.attribution import (RF_PARAMS, block_factor, block_mean, block_majority, calc_anomalies,
+                                build_feature_cube, sample_training_rows,
+                                pooled_attribution, pixel_attribution, classify_dominance)
+from common.preview import open_raster, preview_paths, PREVIEW_FACTOR
 
 # ===============================
 # Directory and configuration
@@ -14,8 +34,51 @@ ecoindex_dir = r"D:\project\data\EcoIndex"
 driver_dir = r"D:\project\data\Drivers"
 output_dir = r"D:\project\results\Attribution_Fast"
 shapefile_path = r"D:\project\shapefiles\region_boundary.shp"
+storage_format = 'float32'  # 'float32' or 'scaled' (uint16 importances with scale/offset metadata)
+ecoindex_dir, driver_dir, output_dir = preview_paths(ecoindex_dir, driver_dir, output=output_dir)
 os.makedirs(output_dir, exist_ok=True)
 
+# Resample cache: keyed by source hash, scale factor and resampling mode
+cache_dir = r"D:\project\cache\resampled"
+cache_max_bytes = 20 * 1024 ** 3      # Evict least recently used files above this size
+prefetch_depth = 3                    # Yearly rasters resampled/decoded ahead on a thread pool
+os.makedirs(cache_dir, exist_ok=True)
+
+# Standardized anomalies are written as float32 memory-mapped cubes (.npy) here and
+# reused by later runs while their sources and resampling settings are unchanged
+anomaly_dir = os.path.join(output_dir, 'anomaly_cubes')
+os.makedirs(anomaly_dir, exist_ok=True)
+
+# Block aggregation of drivers to the coarse grid
+clcd_classes = list(range(1, 10))     # Land-cover codes kept by 1_5 (clipped to 1-9)
+clcd_fraction_bands = False           # Also write per-class fractions as CLCD_fractions_{year}.tif in output_dir
+
+# Attribution mode:
+#   'pixel'  - one forest per pixel (original behaviour)
+#   'tile'   - one forest per tile_size x tile_size tile, fitted on all its valid pixels
+#   'window' - as 'tile', but each fit also pools a halo of window_halo neighbouring pixels
+attribution_mode = 'pixel'
+tile_size = 5
+window_halo = 2
+min_valid_years = 10
+dominance_threshold = 0.05            # |climate - human| importance below this is 'mixed'
+n_jobs = -1                           # Parallel tile fits
+
+# Baseline RF training sample: pixels drawn (all their valid years are used), optionally
+# split evenly across subregions ('region') or land-cover classes ('landcover')
+train_sample_size = 20000
+train_strata = None                   # None, 'region' or 'landcover'
+strata_shapefiles = {
+    'Northern Xinjiang': r"D:\project\data\shapefiles\north_region.shp",
+    'Southern Xinjiang': r"D:\project\data\shapefiles\south_region.shp",
+    'Eastern Xinjiang': r"D:\project\data\shapefiles\east_region.shp"
+}
+
+# Full-resolution, out-of-core attribution: streams stream_tile_size x stream_tile_size
+# windows of the native rasters instead of loading resampled stacks
+full_resolution = False
+stream_tile_size = 256
+
 years = np.arange(2000, 2024)
 
 # Define driver variables and their folder/key mapping
@@ -33,187 +96,381 @@ driver_mapping = {
 shapefile = gpd.read_file(shapefile_path)
 geoms = shapefile.geometry.values
 
+# ===============================
+# Resampling mode (exact block aggregation where 1/scale_factor is an integer)
+# ===============================
+def resampling_mode(scale_factor, is_categorical=False):
+    if block_factor(scale_factor) is None:
+        return 'gdal_mode' if is_categorical else 'gdal_average'
+    if is_categorical:
+        # The class list shapes the majority and fraction bands, so it is part of the cache key
+        classes = ','.join(str(c) for c in clcd_classes)
+        return f"{'block_majority+fractions' if clcd_fraction_bands else 'block_majority'}[{classes}]"
+    return 'block_mean'
+
 # ===============================
 # Resample raster to lower resolution
 # ===============================
 def resample_raster(input_path, output_path, scale_factor, is_categorical=False):
-    with rasterio.open(input_path) as src:
-        new_width = int(src.width * scale_factor)
-        new_height = int(src.height * scale_factor)
+    with open_raster(input_path, categorical=is_categorical) as src:
+        factor = block_factor(scale_factor)
+
+        if factor is not None:
+            data = decode_band(src, src.read(1))
+            valid = valid_pixels(data, None if is_scaled(src) else src.nodata)
 
-        if is_categorical:
-            data = src.read(1)
-            resampled = data[::int(1 / scale_factor), ::int(1 / scale_factor)][np.newaxis, :, :]
+            if is_categorical:
+                majority, fractions = block_majority(data, valid, factor, clcd_classes)
+                bands = [majority] + (list(fractions) if clcd_fraction_bands else [])
+                resampled = np.stack(bands)
+            else:
+                resampled = block_mean(data, valid, factor)[np.newaxis, :, :]
+            transform = src.transform * Affine.scale(factor)
         else:
-            resampled = src.read(
-                out_shape=(src.count, new_height, new_width),
-                resampling=Resampling.average
+            # Non-integer factors fall back to GDAL resampling
+            new_width = int(src.width * scale_factor)
+            new_height = int(src.height * scale_factor)
+            resampled = decode_band(src, src.read(
+                1,
+                out_shape=(new_height, new_width),
+                resampling=Resampling.mode if is_categorical else Resampling.average,
+                masked=True
+            )).astype(np.float32).filled(np.nan)[np.newaxis, :, :]
+            transform = src.transform * Affine.scale(
+                src.width / resampled.shape[-1],
+                src.height / resampled.shape[-2]
             )
 
-        transform = src.transform * src.transform.scale(
-            src.width / resampled.shape[-1],
-            src.height / resampled.shape[-1]
-        )
-
         profile = src.profile
         profile.update({
+            'driver': 'GTiff',
+            'count': resampled.shape[0],
+            'dtype': 'float32',
+            'nodata': np.nan,
             'height': resampled.shape[1],
             'width': resampled.shape[2],
             'transform': transform
         })
 
         with rasterio.open(output_path, 'w', **profile) as dst:
-            dst.write(resampled)
+            dst.write(resampled.astype(np.float32))
 
 # ===============================
-# Load and preprocess annual rasters
+# Content-addressed resample cache
 # ===============================
-def load_stack(folder, keyword, years, scale_factor=0.25, is_index=False, is_categorical=False):
-    stack = []
-    for year in years:
-        if is_index:
-            path = os.path.join(folder, f"{year}_EcoIndex.tif")
-        elif keyword in ['Nightlight', 'CLCD']:
-            path = os.path.join(folder, f"{keyword}_{year}.tif_remove.tif")
-        else:
-            path = os.path.join(folder, f"{year}_{keyword}.tif_remove.tif")
+_digest_memo = {}
+_cache_lock = threading.Lock()  # Cache bookkeeping is shared by the prefetch threads
+
+def file_digest(path, chunk_size=8 * 1024 * 1024):
+    """SHA-1 of the file content, memoized on (path, size, mtime)."""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _digest_memo:
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha.update(chunk)
+        _digest_memo[memo_key] = sha.hexdigest()
+    return _digest_memo[memo_key]
 
-        resampled_path = path.replace(".tif", "_resampled.tif")
-        if not os.path.exists(resampled_path):
-            resample_raster(path, resampled_path, scale_factor, is_categorical=is_categorical)
+def evict_resample_cache(max_bytes, keep=()):
+    """Remove least recently used cache files until the cache fits in max_bytes."""
+    entries = []
+    for f in os.listdir(cache_dir):
+        if f.endswith('.tif'):
+            p = os.path.join(cache_dir, f)
+            st = os.stat(p)
+            entries.append((st.st_mtime, st.st_size, p))
+    total = sum(size for _, size, _ in entries)
+    for _, size, p in sorted(entries):
+        if total <= max_bytes:
+            break
+        if p in keep:
+            continue
+        os.remove(p)
+        total -= size
+
+def cached_resample(path, scale_factor, is_categorical=False):
+    """Return the cache path of the resampled raster, building it on a miss."""
+    mode = resampling_mode(scale_factor, is_categorical)
+    key = hashlib.sha1(f"{file_digest(path)}|{scale_factor:.6f}|{mode}|preview{PREVIEW_FACTOR}".encode()).hexdigest()
+    cache_path = os.path.join(cache_dir, f"{key}.tif")
 
-        with rasterio.open(resampled_path) as src:
-            img, _ = mask(src, geoms, crop=False)
-            stack.append(img[0])
-            transform = src.transform
-            crs = src.crs
-    return np.array(stack), transform, crs
+    if os.path.exists(cache_path):
+        os.utime(cache_path)  # Mark as recently used
+    else:
+        # Unique temp name: byte-identical sources (e.g. a copied CLCD year) share a key
+        # and may be resampled concurrently on the prefetch threads
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=f"{key}.", suffix='.tmp')
+        os.close(fd)
+        try:
+            resample_raster(path, tmp_path, scale_factor, is_categorical=is_categorical)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with _cache_lock:
+            evict_resample_cache(cache_max_bytes, keep=(cache_path,))
+    return cache_path
 
-# Load EcoIndex stack
-eco_stack, transform, crs = load_stack(ecoindex_dir, None, years, scale_factor=0.25, is_index=True)
+def read_cached_masked(cache_path):
+    """Band 1 of a cached raster masked to the study area, with its transform and crs."""
+    with rasterio.open(cache_path) as src:
+        img, _ = mask(src, geoms, crop=False)
+        return img[0], src.transform, src.crs
 
-# Load drivers
-driver_stacks = {}
-for var, (subfolder, keyword) in driver_mapping.items():
-    full_path = os.path.join(driver_dir, subfolder)
-    is_categorical = (var == 'CLCD')
-    driver_stacks[var], _, _ = load_stack(full_path, keyword, years, scale_factor=0.25, is_categorical=is_categorical)
+def export_clcd_fractions(cache_path, year):
+    """Copy the per-class fraction bands (2..N+1) of a cached CLCD raster to CLCD_fractions_{year}.tif."""
+    with rasterio.open(cache_path) as src:
+        if src.count < 2:
+            return  # GDAL fallback for non-integer factors has no fraction bands
+        img, _ = mask(src, geoms, crop=False, indexes=list(range(2, src.count + 1)))
+        profile = dict(src.profile, count=img.shape[0])
+    with rasterio.open(os.path.join(output_dir, f"CLCD_fractions_{year}.tif"), 'w', **profile) as dst:
+        dst.write(img)
+        for band, c in enumerate(clcd_classes, start=1):
+            dst.set_band_description(band, f"CLCD class {c} fraction")
+
+# ===============================
+# Load and preprocess annual rasters
+# ===============================
+def stack_path(folder, keyword, year, is_index=False):
+    if is_index:
+        return os.path.join(folder, f"{year}_EcoIndex.tif")
+    return driver_path(folder, keyword, year)
 
 # ===============================
 # Calculate standardized anomalies
 # ===============================
-def calc_anomalies(stack, categorical=False):
-    if categorical:
-        return stack
-    mean = np.nanmean(stack, axis=0)
-    std = np.nanstd(stack, axis=0)
-    return (stack - mean) / (std + 1e-6)
-
-eco_anomaly = calc_anomalies(eco_stack)
-driver_anomalies = {
-    var: calc_anomalies(driver_stacks[var], categorical=(var == 'CLCD'))
-    for var in driver_stacks
-}
+def anomaly_key(paths, scale_factor, is_categorical):
+    """Digest of everything an anomaly cube depends on: sources (path, size, mtime), resampling and region."""
+    sha = hashlib.sha1(f"{scale_factor:.6f}|{resampling_mode(scale_factor, is_categorical)}|"
+                       f"{geometry_key(geoms)}|preview{PREVIEW_FACTOR}".encode())
+    for p in paths:
+        st = os.stat(p)
+        sha.update(f"|{os.path.abspath(p)}|{st.st_size}|{st.st_mtime_ns}".encode())
+    return sha.hexdigest()
+
+def stream_anomalies(name, folder, keyword, years, scale_factor=0.25, is_index=False, is_categorical=False):
+    """
+    Read the yearly layers once, accumulating per-pixel mean and variance with
+    Welford's update while copying each layer into a float32 memory-mapped cube,
+    then standardize the cube in place one year at a time. Categorical layers are
+    kept as raw values. Returns the cube opened read-only (lazy), transform and crs.
+    A cube built from the same inputs by an earlier run is reused without decoding.
+    """
+    cube_path = os.path.join(anomaly_dir, f"{name}_anomaly.npy")
+    info_path = os.path.join(anomaly_dir, f"{name}_anomaly.json")
+    key = anomaly_key([stack_path(folder, keyword, y, is_index=is_index) for y in years], scale_factor, is_categorical)
+    if os.path.exists(cube_path) and os.path.exists(info_path):
+        with open(info_path) as f:
+            info = json.load(f)
+        if info['key'] == key:
+            return np.load(cube_path, mmap_mode='r'), Affine(*info['transform']), CRS.from_wkt(info['crs'])
+        os.remove(info_path)  # An interrupted rebuild must not leave a matching key behind
+    cube = None
+
+    def read_year(year):
+        path = stack_path(folder, keyword, year, is_index=is_index)
+        cache_path = cached_resample(path, scale_factor, is_categorical=is_categorical)
+        if is_categorical and clcd_fraction_bands:
+            export_clcd_fractions(cache_path, year)
+        return read_cached_masked(cache_path)
+
+    reader = Prefetcher(list(years), read_year, depth=prefetch_depth, label=f"{name} reads")
+    for t, (layer, transform, crs) in enumerate(reader):
+        if cube is None:
+            cube = np.lib.format.open_memmap(cube_path, mode='w+', dtype=np.float32, shape=(len(years),) + layer.shape)
+            count = np.zeros(layer.shape, dtype=np.int32)
+            mean = np.zeros(layer.shape, dtype=np.float64)
+            m2 = np.zeros(layer.shape, dtype=np.float64)
+        cube[t] = layer
+
+        if not is_categorical:
+            valid = ~np.isnan(layer)
+            count[valid] += 1
+            delta = layer[valid] - mean[valid]
+            mean[valid] += delta / count[valid]
+            m2[valid] += delta * (layer[valid] - mean[valid])
+    reader.report()
+
+    if not is_categorical:
+        has = count > 0
+        mean[~has] = np.nan
+        std = np.sqrt(np.divide(m2, count, out=np.full(m2.shape, np.nan), where=has))  # Population std, as np.nanstd
+        for t in range(len(years)):
+            cube[t] = (cube[t] - mean) / (std + 1e-6)
+    cube.flush()
+    del cube
+    with open(info_path, 'w') as f:
+        json.dump({'key': key, 'transform': list(transform)[:6], 'crs': crs.to_wkt()}, f)
+    return np.load(cube_path, mmap_mode='r'), transform, crs
 
 # ===============================
-# Sample training data for RF
+# Attribution: pixel-wise or pooled feature importance
 # ===============================
-height, width = eco_anomaly.shape[1:]
-np.random.seed(42)
-valid_pixels = np.argwhere(~np.isnan(eco_anomaly[0]))
-selected_idx = valid_pixels[np.random.choice(valid_pixels.shape[0], size=20000, replace=False)]
+def attribute(eco_anomaly, features, show_progress=True):
+    if attribution_mode in ('tile', 'window'):
+        halo = window_halo if attribution_mode == 'window' else 0
+        return pooled_attribution(eco_anomaly, features, tile_size, halo, min_valid_years,
+                                  n_jobs=n_jobs, show_progress=show_progress)
+    return pixel_attribution(eco_anomaly, features, min_valid_years, show_progress=show_progress)
 
-X_train, y_train = [], []
-for idx in selected_idx:
-    i, j = idx
-    y_series = eco_anomaly[:, i, j]
-    X_series = np.stack([driver_anomalies[v][:, i, j] for v in driver_mapping], axis=1)
-    mask = ~np.isnan(y_series) & ~np.isnan(X_series).any(axis=1)
-    if np.sum(mask) < 10:
-        continue
-    y_train.append(y_series[mask])
-    X_train.append(X_series[mask])
+# ===============================
+# Stratification labels for the baseline training sample
+# ===============================
+def training_strata(features, transform, shape):
+    if train_strata == 'region':
+        labels = np.zeros(shape, dtype=np.int32)
+        for k, shp in enumerate(strata_shapefiles.values(), start=1):
+            inside = rasterio.features.geometry_mask(gpd.read_file(shp).geometry.values, out_shape=shape,
+                                                     transform=transform, invert=True)
+            labels[inside & (labels == 0)] = k
+        return labels
+    if train_strata == 'landcover':
+        # Most recent observed CLCD class per pixel (CLCD is kept as raw codes)
+        clcd = features[..., list(driver_mapping).index('CLCD')]
+        latest = np.full(shape, np.nan, dtype=np.float32)
+        for layer in clcd:
+            latest = np.where(np.isnan(layer), latest, layer)
+        return np.nan_to_num(latest, nan=0).astype(np.int32)
+    return None
 
-X_train_all = np.vstack(X_train)
-y_train_all = np.hstack(y_train)
+def output_profiles(height, width, crs, transform):
+    profile = {'height': height, 'width': width, 'crs': crs, 'transform': transform}
+    importance_encoding = 'importance' if storage_format == 'scaled' else None
+    dominance_profile = dict(profile, driver='GTiff', count=1, dtype='uint8', nodata=0)
+    return profile, importance_encoding, dominance_profile
 
 # ===============================
-# Train baseline Random Forest
+# In-memory attribution on resampled stacks
 # ===============================
-rf = RandomForestRegressor(n_estimators=100, max_depth=10, random_state=42, n_jobs=-1)
-rf.fit(X_train_all, y_train_all)
-print("✅ Random Forest model trained.")
+def in_memory_attribution():
+    # Stream EcoIndex and driver layers into memory-mapped anomaly cubes
+    eco_anomaly, transform, crs = stream_anomalies('EcoIndex', ecoindex_dir, None, years, scale_factor=0.25, is_index=True)
+
+    driver_anomalies = {}
+    for var, (subfolder, keyword) in driver_mapping.items():
+        full_path = os.path.join(driver_dir, subfolder)
+        driver_anomalies[var], _, _ = stream_anomalies(var, full_path, keyword, years, scale_factor=0.25,
+                                                       is_categorical=(var == 'CLCD'))
+
+    # ===============================
+    # Sample training data for RF
+    # ===============================
+    height, width = eco_anomaly.shape[1:]
+    features = build_feature_cube([driver_anomalies[v] for v in driver_mapping],
+                                  path=os.path.join(anomaly_dir, 'features.npy'))
+    eco_anomaly = np.asarray(eco_anomaly)
+    X_train_all, y_train_all = sample_training_rows(
+        eco_anomaly, features, train_sample_size, min_valid_years,
+        strata=training_strata(features, transform, (height, width)), seed=42
+    )
+    print(f"✅ Training sample: {len(y_train_all)} pixel-years")
+
+    # ===============================
+    # Train baseline Random Forest
+    # ===============================
+    rf = RandomForestRegressor(**RF_PARAMS, n_jobs=-1)
+    rf.fit(X_train_all, y_train_all)
+    print("✅ Random Forest model trained.")
+
+    importance_array = attribute(eco_anomaly, features)
+
+    # ===============================
+    # Save feature importance and dominance maps
+    # ===============================
+    profile, importance_encoding, dominance_profile = output_profiles(height, width, crs, transform)
+    for idx, var in enumerate(driver_mapping):
+        output_path = os.path.join(output_dir, f"{var}_importance_fast.tif")
+        write_product(output_path, importance_array[:, :, idx], profile, encoding=importance_encoding)
+
+    out_path = os.path.join(output_dir, "Driver_Dominance_fast.tif")
+    with rasterio.open(out_path, 'w', **dominance_profile) as dst:
+        dst.write(classify_dominance(importance_array, dominance_threshold), 1)
 
 # ===============================
-# Attribution: pixel-wise feature importance
+# Full-resolution, out-of-core attribution
 # ===============================
-importance_array = np.full((height, width, len(driver_mapping)), np.nan)
+def open_aligned(path, ref, is_categorical=False):
+    """Open a raster on the reference grid; misaligned rasters are warped on the fly."""
+    src = open_raster(path, categorical=is_categorical)
+    if src.crs == ref.crs and src.transform == ref.transform and src.shape == ref.shape:
+        return src, src
+    vrt = WarpedVRT(src, crs=ref.crs, transform=ref.transform, width=ref.width, height=ref.height,
+                    resampling=Resampling.mode if is_categorical else Resampling.average)
+    return src, vrt
 
-for i in tqdm(range(height), desc="Pixel-wise Attribution"):
-    for j in range(width):
-        y = eco_anomaly[:, i, j]
-        X = np.stack([driver_anomalies[v][:, i, j] for v in driver_mapping], axis=1)
-        if np.isnan(y).all() or np.isnan(X).all():
-            continue
-        mask = ~np.isnan(y) & ~np.isnan(X).any(axis=1)
-        if np.sum(mask) < 10:
-            continue
-        rf_pixel = RandomForestRegressor(n_estimators=100, max_depth=10, random_state=42, n_jobs=-1)
-        rf_pixel.fit(X[mask], y[mask])
-        importance_array[i, j, :] = rf_pixel.feature_importances_
-
-# ===============================
-# Save feature importance maps
-# ===============================
-for idx, var in enumerate(driver_mapping):
-    output_path = os.path.join(output_dir, f"{var}_importance_fast.tif")
-    with rasterio.open(
-        output_path,
-        'w',
-        driver='GTiff',
-        height=height,
-        width=width,
-        count=1,
-        dtype='float32',
-        crs=crs,
-        transform=transform,
-        nodata=np.nan
-    ) as dst:
-        dst.write(importance_array[:, :, idx], 1)
-
-# ===============================
-# Generate driver dominance classification
-# ===============================
-dominance_map = np.full((height, width), np.nan)
-
-for i in range(height):
-    for j in range(width):
-        importance = importance_array[i, j, :]
-        if np.isnan(importance).all():
-            continue
-        climate_score = np.sum(importance[0:3])   # PR, SOIL, TEMP
-        human_score = np.sum(importance[3:5])     # NL, CLCD
+def read_window(datasets, window, region):
+    """(years, h, w) float32 stack of one window; nodata and outside-region pixels are NaN."""
+    layers = []
+    for src, reader in datasets:
+        data = decode_band(src, reader.read(1, window=window, masked=True))
+        layer = np.ma.filled(data.astype(np.float32), np.nan)
+        layer[~valid_pixels(layer)] = np.nan
+        layers.append(layer)
+    stack = np.stack(layers)
+    stack[:, ~region] = np.nan
+    return stack
 
-        if abs(climate_score - human_score) <= 0.05:
-            dominance_map[i, j] = 3  # Mixed influence
-        elif climate_score > human_score:
-            dominance_map[i, j] = 1  # Climate-dominated
-        else:
-            dominance_map[i, j] = 2  # Human-dominated
-
-out_path = os.path.join(output_dir, "Driver_Dominance_fast.tif")
-with rasterio.open(
-    out_path,
-    'w',
-    driver='GTiff',
-    height=height,
-    width=width,
-    count=1,
-    dtype='uint8',
-    crs=crs,
-    transform=transform,
-    nodata=0
-) as dst:
-    dst.write(dominance_map.astype('uint8'), 1)
+def streaming_attribution():
+    """
+    Attribute EcoIndex anomalies at the native resolution, one window at a time.
+    Per-pixel anomalies only depend on the pixel's own series, so they are exact
+    within each window; pooled fits ('tile'/'window') stay within the window.
+    """
+    ref = open_raster(stack_path(ecoindex_dir, None, years[0], is_index=True))
+    eco_sets = [open_aligned(stack_path(ecoindex_dir, None, y, is_index=True), ref) for y in years]
+    driver_sets = {}
+    for var, (subfolder, keyword) in driver_mapping.items():
+        folder = os.path.join(driver_dir, subfolder)
+        driver_sets[var] = [open_aligned(stack_path(folder, keyword, y), ref, is_categorical=(var == 'CLCD'))
+                            for y in years]
+
+    height, width = ref.height, ref.width
+    profile, importance_encoding, dominance_profile = output_profiles(height, width, ref.crs, ref.transform)
+    importance_dsts = [open_product(os.path.join(output_dir, f"{var}_importance_fast.tif"), profile, importance_encoding)
+                       for var in driver_mapping]
+    dominance_dst = rasterio.open(os.path.join(output_dir, "Driver_Dominance_fast.tif"), 'w', **dominance_profile)
+
+    windows = [Window(c0, r0, min(stream_tile_size, width - c0), min(stream_tile_size, height - r0))
+               for r0 in range(0, height, stream_tile_size) for c0 in range(0, width, stream_tile_size)]
+
+    try:
+        for window in tqdm(windows, desc="Streaming Attribution", unit="window"):
+            region = rasterio.features.geometry_mask(
+                geoms, out_shape=(window.height, window.width),
+                transform=rasterio.windows.transform(window, ref.transform), invert=True
+            )
+            importance = np.full((window.height, window.width, len(driver_mapping)), np.nan, dtype=np.float32)
+
+            if region.any():
+                eco_window = read_window(eco_sets, window, region)
+                if not np.isnan(eco_window).all():
+                    eco_anomaly = calc_anomalies(eco_window)
+                    features = build_feature_cube([
+                        calc_anomalies(read_window(driver_sets[var], window, region), categorical=(var == 'CLCD'))
+                        for var in driver_mapping
+                    ])
+                    importance = attribute(eco_anomaly, features, show_progress=False)
+
+            for idx, dst in enumerate(importance_dsts):
+                write_window(dst, importance[:, :, idx], importance_encoding, window=window)
+            dominance_dst.write(classify_dominance(importance, dominance_threshold), 1, window=window)
+    finally:
+        for dst in importance_dsts + [dominance_dst]:
+            dst.close()
+        for datasets in [eco_sets] + list(driver_sets.values()):
+            for src, reader in datasets:
+                if reader is not src:
+                    reader.close()
+                src.close()
+        ref.close()
+
+if full_resolution:
+    streaming_attribution()
+else:
+    in_memory_attribution()
 
 print("🏁 Completed attribution and classification mapping.")
@@ -1,16 +1,21 @@
 import os
 import numpy as np
-import rasterio
 import geopandas as gpd
 import pandas as pd
 import matplotlib.pyplot as plt
 from rasterio.mask import mask
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.scaled_raster import decode_band, is_scaled
+from common.validity import valid_pixels
+from common.preview import open_raster, preview_paths
 
 # =========================
 # Define file paths
 # =========================
 driver_raster_dir = r"D:\project\outputs\driver_attribution"
 output_dir = r"D:\project\outputs\region_stats"
+driver_raster_dir, output_dir = preview_paths(driver_raster_dir, output=output_dir)
 os.makedirs(output_dir, exist_ok=True)
 
 # Region shapefiles (province-wide and sub-regions)
@@ -31,17 +36,67 @@ driver_rasters = {
 }
 dominance_raster = 'Driver_Dominance_fast.tif'
 
+# Spatial block bootstrap of the regional means and class percentages
+# (pixels are autocorrelated, so whole blocks are resampled rather than pixels)
+bootstrap = True
+bootstrap_block_size = 16     # Block side in pixels
+bootstrap_replicates = 2000
+bootstrap_alpha = 0.05        # Two-sided; CI columns hold the alpha/2 and 1 - alpha/2 percentiles
+bootstrap_chunk = 250         # Replicates per matrix product (bounds the weight-matrix memory)
+bootstrap_seed = 42
+
 # =========================
 # Utility: Mask raster with region shapefile
 # =========================
 def read_masked_data(raster_path, shapefile_path):
-    with rasterio.open(raster_path) as src:
+    with open_raster(raster_path) as src:
         gdf = gpd.read_file(shapefile_path)
         masked, _ = mask(src, gdf.geometry, crop=False)
-        data = masked[0]
-        data = np.where((data == src.nodata) | (np.isnan(data)), np.nan, data)
+        data = decode_band(src, masked[0]).astype(np.float32)
+        data = np.where(valid_pixels(data, None if is_scaled(src) else src.nodata), data, np.nan)
     return data
 
+# =========================
+# Utility: Spatial block bootstrap on per-block aggregates
+# =========================
+def block_aggregates(layers, block_size):
+    """
+    Per-block sums and valid-pixel counts of each (h, w) layer (NaN = invalid),
+    shape (layers, blocks), keeping only blocks with data in at least one layer.
+    """
+    h, w = layers[0].shape
+    n_block_cols = -(-w // block_size)
+    ids = (np.arange(h) // block_size)[:, None] * n_block_cols + (np.arange(w) // block_size)[None, :]
+    n_blocks = -(-h // block_size) * n_block_cols
+    sums = np.zeros((len(layers), n_blocks))
+    counts = np.zeros((len(layers), n_blocks))
+    for k, layer in enumerate(layers):
+        valid = ~np.isnan(layer)
+        sums[k] = np.bincount(ids[valid], weights=layer[valid], minlength=n_blocks)
+        counts[k] = np.bincount(ids[valid], minlength=n_blocks)
+    keep = counts.sum(axis=0) > 0
+    return sums[:, keep], counts[:, keep]
+
+def bootstrap_mean_ci(sums, counts, seed=bootstrap_seed):
+    """
+    Percentile CI of each layer's pixel mean. A replicate draws the blocks with
+    replacement, i.e. one multinomial row of block weights W, so all replicate
+    means are (W @ sums) / (W @ counts) for a (replicates, blocks) matrix W.
+    """
+    n_blocks = sums.shape[1]
+    if n_blocks == 0:
+        # No valid pixels in the region: NaN bounds, like the point statistics
+        return np.full(sums.shape[0], np.nan), np.full(sums.shape[0], np.nan), 0
+    rng = np.random.default_rng(seed)
+    means = []
+    for start in range(0, bootstrap_replicates, bootstrap_chunk):
+        size = min(bootstrap_chunk, bootstrap_replicates - start)
+        W = rng.multinomial(n_blocks, np.full(n_blocks, 1 / n_blocks), size=size).astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means.append((W @ sums.T) / (W @ counts.T))
+    lower, upper = np.nanpercentile(np.vstack(means), [50 * bootstrap_alpha, 100 - 50 * bootstrap_alpha], axis=0)
+    return lower, upper, n_blocks
+
 # =========================
 # Part 1: Statistics of driver importance
 # =========================
@@ -49,12 +104,21 @@ importance_results = []
 
 for region_name, shp_path in region_shapefiles.items():
     region_stats = {'Region': region_name}
+    layers = []
     for var, filename in driver_rasters.items():
         raster_path = os.path.join(driver_raster_dir, filename)
         data = read_masked_data(raster_path, shp_path)
         valid = data[~np.isnan(data)]
         region_stats[f'{var}_Mean'] = np.nanmean(valid)
         region_stats[f'{var}_Median'] = np.nanmedian(valid)
+        layers.append(data)
+
+    if bootstrap:
+        lower, upper, n_blocks = bootstrap_mean_ci(*block_aggregates(layers, bootstrap_block_size))
+        for k, var in enumerate(driver_rasters):
+            region_stats[f'{var}_Mean_CI_Lower'] = lower[k]
+            region_stats[f'{var}_Mean_CI_Upper'] = upper[k]
+        region_stats['Bootstrap_Blocks'] = n_blocks
     importance_results.append(region_stats)
 
 importance_df = pd.DataFrame(importance_results)
@@ -76,12 +140,22 @@ for region_name, shp_path in region_shapefiles.items():
     human = np.sum(valid == 2)
     mixed = np.sum(valid == 3)
 
-    dominance_results.append({
+    region_stats = {
         'Region': region_name,
         'Climate_Dominated_%': climate / total * 100,
         'Human_Dominated_%': human / total * 100,
         'Mixed_Influence_%': mixed / total * 100
-    })
+    }
+
+    if bootstrap:
+        # A class percentage is the mean of its 0/1 indicator over valid pixels
+        indicators = [np.where(np.isnan(data), np.nan, data == c) for c in (1, 2, 3)]
+        lower, upper, n_blocks = bootstrap_mean_ci(*block_aggregates(indicators, bootstrap_block_size))
+        for k, column in enumerate(['Climate_Dominated_%', 'Human_Dominated_%', 'Mixed_Influence_%']):
+            region_stats[f'{column}_CI_Lower'] = lower[k] * 100
+            region_stats[f'{column}_CI_Upper'] = upper[k] * 100
+        region_stats['Bootstrap_Blocks'] = n_blocks
+    dominance_results.append(region_stats)
 
 dominance_df = pd.DataFrame(dominance_results)
 dominance_df.to_csv(os.path.join(output_dir, 'Driver_Dominance_Statistics.csv'), index=False)
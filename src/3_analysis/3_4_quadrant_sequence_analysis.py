@@ -0,0 +1,123 @@
+import os
+import numpy as np
+import rasterio
+from rasterio.transform import Affine
+from tqdm import tqdm
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.preview import open_raster, preview_paths
+
+# ==========================================
+# Define input/output paths (customize here)
+# ==========================================
+quadrant_dir = r"D:\your_project\results\quadrant_classification"
+output_dir = r"D:\your_project\results\quadrant_shifts"
+quadrant_dir, output_dir = preview_paths(quadrant_dir, output=output_dir)
+store_path = os.path.join(output_dir, "Quadrant_Sequence_store.npz")
+
+years = list(range(2001, 2024))  # {year}_Quadrant.tif written by 2_2
+
+os.makedirs(output_dir, exist_ok=True)
+
+# ==========================================
+# Bit-packed quadrant sequence store
+#   3 bits per pixel-year: two bits hold (quadrant - 1), one bit marks validity
+#   planes: (years, 3, ceil(pixels / 8)) uint8
+# ==========================================
+def pack_layer(quadrant):
+    flat = quadrant.ravel()
+    valid = (flat >= 1) & (flat <= 4)
+    code = np.where(valid, flat - 1, 0).astype(np.uint8)
+    return np.stack([np.packbits(code & 1), np.packbits(code >> 1), np.packbits(valid)])
+
+def unpack_layer(planes, n_pixels):
+    lo, hi, valid = (np.unpackbits(p, count=n_pixels) for p in planes)
+    return (lo | (hi << 1)) + 1, valid.astype(bool)
+
+def build_store():
+    planes = []
+    for year in tqdm(years, desc="Packing quadrant maps"):
+        with open_raster(os.path.join(quadrant_dir, f"{year}_Quadrant.tif"), categorical=True) as src:
+            planes.append(pack_layer(src.read(1)))
+            shape, transform, crs = src.shape, src.transform, src.crs
+    np.savez_compressed(
+        store_path, planes=np.stack(planes), years=np.array(years), shape=np.array(shape),
+        transform=np.array(transform[:6]), crs=np.array(crs.to_wkt() if crs else '')
+    )
+
+def store_is_current():
+    if not os.path.exists(store_path):
+        return False
+    with np.load(store_path) as store:
+        if list(store['years']) != years:
+            return False
+    store_time = os.path.getmtime(store_path)
+    return all(os.path.getmtime(os.path.join(quadrant_dir, f"{y}_Quadrant.tif")) <= store_time for y in years)
+
+if not store_is_current():
+    build_store()
+
+store = np.load(store_path)
+planes = store['planes']
+height, width = (int(v) for v in store['shape'])
+transform = Affine(*store['transform'])
+crs = str(store['crs']) or None
+n_pixels = height * width
+
+# ==========================================
+# Vectorized shift analytics in one pass over the years
+# ==========================================
+counts = np.zeros((4, n_pixels), dtype=np.int16)
+longest_run = np.zeros((4, n_pixels), dtype=np.int16)
+run = np.zeros(n_pixels, dtype=np.int16)
+switches = np.zeros(n_pixels, dtype=np.int16)
+last_transition = np.zeros(n_pixels, dtype=np.int16)
+prev_year_q = np.zeros(n_pixels, dtype=np.uint8)   # Quadrant of the previous year (0 if invalid)
+last_valid_q = np.zeros(n_pixels, dtype=np.uint8)  # Most recent valid quadrant
+
+for t, year in enumerate(tqdm(years, desc="Quadrant shift analytics")):
+    q, valid = unpack_layer(planes[t], n_pixels)
+
+    # Runs are consecutive valid years in the same quadrant; an invalid year ends a run
+    run = np.where(valid & (q == prev_year_q), run + 1, valid.astype(np.int16))
+    for c in range(4):
+        in_c = valid & (q == c + 1)
+        counts[c] += in_c
+        np.maximum(longest_run[c], np.where(in_c, run, 0), out=longest_run[c])
+
+    # Switches compare with the most recent valid quadrant, skipping gaps
+    switched = valid & (last_valid_q > 0) & (q != last_valid_q)
+    switches += switched
+    last_transition[switched] = year
+
+    prev_year_q = np.where(valid, q, 0).astype(np.uint8)
+    last_valid_q = np.where(valid, q, last_valid_q).astype(np.uint8)
+
+observed = counts.sum(axis=0) > 0
+dominant = np.where(observed, counts.argmax(axis=0) + 1, 0).astype(np.uint8)  # Ties go to the lower quadrant
+
+# ==========================================
+# Save analytics rasters
+# ==========================================
+def save(name, array, dtype, nodata):
+    array = array.reshape((-1, height, width))
+    with rasterio.open(
+        os.path.join(output_dir, f"{name}.tif"),
+        'w',
+        driver='GTiff',
+        height=height,
+        width=width,
+        count=array.shape[0],
+        dtype=dtype,
+        crs=crs,
+        transform=transform,
+        nodata=nodata
+    ) as dst:
+        dst.write(array.astype(dtype))
+
+save('Quadrant_Dominant', dominant, 'uint8', 0)
+save('Quadrant_Switches', np.where(observed, switches, -1), 'int16', -1)
+save('Quadrant_LongestRun_Q1-Q4', np.where(observed, longest_run, -1), 'int16', -1)
+save('Quadrant_LastTransitionYear', last_transition, 'int16', 0)
+
+print(f"✅ Quadrant sequence analytics saved in: {output_dir}")
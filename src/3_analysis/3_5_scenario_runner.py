@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import numpy as np
+import rasterio
+import rasterio.features
+from rasterio.transform import Affine
+import geopandas as gpd
+from sklearn.decomposition import PCA
+from joblib import Parallel, delayed
+from tqdm import tqdm
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.scaled_raster import write_product, decode_band, is_scaled
+from common.validity import load_or_build_validity, valid_pixels, geometry_key
+from common.prefetch import Prefetcher
+from common.trend_kernels import block_trends, mk_state, mk_pvalue
+from common.paths import driver_path
+from common.attribution import (RF_PARAMS, block_factor, block_mean, block_majority, calc_anomalies,
+                                build_feature_cube, pooled_attribution, pixel_attribution, classify_dominance)
+from common.preview import open_raster, preview_paths
+
+# ===============================
+# Directory and configuration
+# ===============================
+ndvi_dir = r"D:\your_project\data\NDVI_cleaned"
+wue_dir = r"D:\your_project\data\WUE_cleaned"
+driver_dir = r"D:\project\data\Drivers"
+shapefile_path = r"D:\your_project\shapefiles\region_boundary.shp"   # Study area of the shared stacks
+scenario_root = r"D:\your_project\results\scenarios"
+storage_format = 'float32'  # 'float32' or 'scaled' (int16/uint16 with scale/offset metadata)
+prefetch_depth = 3          # Yearly rasters decoded ahead on a thread pool
+
+all_years = list(range(2000, 2024))
+driver_scale_factor = 0.25  # Driver grid relative to the NDVI/WUE grid (as in 3_2)
+clcd_classes = list(range(1, 10))
+block_rows = 16             # Rows per block for the vectorized trend kernels
+slope_ci_alpha = 0.05
+scenario_jobs = 4           # Scenarios evaluated in parallel (each fits its forests serially)
+
+driver_mapping = {
+    'PR': ('Precipitation', 'TerraClimate_pr'),
+    'SOIL': ('SoilMoisture', 'TerraClimate_soil'),
+    'TEMP': ('Temperature', 'TerraClimate_AvgTemp'),
+    'NL': ('Nightlight', 'Nightlight'),
+    'CLCD': ('LandCover', 'CLCD')
+}
+
+# Scenarios are every combination of region x year range x parameter set
+regions = {
+    'Xinjiang': r"D:\your_project\shapefiles\region_boundary.shp",
+    'Northern': r"D:\your_project\shapefiles\north_region.shp",
+    'Southern': r"D:\your_project\shapefiles\south_region.shp",
+    'Eastern': r"D:\your_project\shapefiles\east_region.shp"
+}
+year_ranges = {
+    '2000-2010': (2000, 2010),
+    '2011-2023': (2011, 2023)
+}
+parameter_sets = {
+    'tile5': {'attribution_mode': 'tile', 'tile_size': 5, 'window_halo': 0, 'min_valid_years': 8,
+              'max_depth': 10, 'dominance_threshold': 0.05}
+}
+
+ndvi_dir, wue_dir, driver_dir, scenario_root = preview_paths(ndvi_dir, wue_dir, driver_dir, output=scenario_root)
+shared_dir = os.path.join(scenario_root, 'shared_stacks')
+os.makedirs(shared_dir, exist_ok=True)
+
+factor = block_factor(driver_scale_factor)
+if factor is None:
+    raise ValueError("driver_scale_factor must be 1/n for an integer n so both grids nest exactly.")
+
+# ===============================
+# Shared stacks: read and masked once, then memory-mapped by every scenario
+# ===============================
+def stack_file(name):
+    return os.path.join(shared_dir, f"{name}.npy")
+
+def settings_file(name):
+    return os.path.join(shared_dir, f"{name}.json")
+
+def stack_is_current(name, paths, settings):
+    """A stack is reused only if it was built with the same settings and is newer than its sources."""
+    path = stack_file(name)
+    if not (os.path.exists(path) and os.path.exists(settings_file(name))):
+        return False
+    with open(settings_file(name)) as f:
+        if json.load(f) != settings:
+            return False
+    return all(os.path.getmtime(p) <= os.path.getmtime(path) for p in paths)
+
+def build_stack(name, paths, read_fn, settings):
+    """Write read_fn(t) for every year into a float32 memory-mapped (years, h, w) cube."""
+    cube = None
+    reader = Prefetcher(list(range(len(paths))), read_fn, depth=prefetch_depth, label=f"{name} reads")
+    for t, layer in enumerate(tqdm(reader, desc=f"Stacking {name}")):
+        if cube is None:
+            cube = np.lib.format.open_memmap(stack_file(name) + '.tmp.npy', mode='w+', dtype=np.float32,
+                                             shape=(len(paths),) + layer.shape)
+        cube[t] = layer
+    reader.report()
+    cube.flush()
+    del cube
+    os.replace(stack_file(name) + '.tmp.npy', stack_file(name))
+    with open(settings_file(name), 'w') as f:
+        json.dump(settings, f, indent=2)
+
+geoms = gpd.read_file(shapefile_path).geometry.values
+# Settings the stacks are built with; changing any of them rebuilds the affected stacks
+native_settings = {'years': all_years, 'region_key': geometry_key(geoms)}
+driver_settings = {'years': all_years, 'factor': factor}
+
+ndvi_paths = [os.path.join(ndvi_dir, f"{y}_NDVI_cleaned.tif") for y in all_years]
+wue_paths = [os.path.join(wue_dir, f"{y}_WUE_cleaned.tif") for y in all_years]
+
+for name, folder, paths in (('NDVI', ndvi_dir, ndvi_paths), ('WUE', wue_dir, wue_paths)):
+    if stack_is_current(name, paths, native_settings):
+        continue
+    validity = load_or_build_validity(os.path.join(folder, f"{name}_validity.npz"), paths, all_years, geoms)
+
+    def read_native(t, paths=paths, validity=validity):
+        with open_raster(paths[t]) as src:
+            layer = decode_band(src, src.read(1)).astype(np.float32)
+        layer[~validity.year(t)] = np.nan
+        return layer
+
+    build_stack(name, paths, read_native, native_settings)
+
+for var, (subfolder, keyword) in driver_mapping.items():
+    paths = [driver_path(os.path.join(driver_dir, subfolder), keyword, y) for y in all_years]
+    settings = dict(driver_settings, classes=clcd_classes) if var == 'CLCD' else driver_settings
+    if stack_is_current(var, paths, settings):
+        continue
+
+    def read_coarse(t, paths=paths, categorical=(var == 'CLCD')):
+        with open_raster(paths[t], categorical=categorical) as src:
+            data = decode_band(src, src.read(1))
+            valid = valid_pixels(data, None if is_scaled(src) else src.nodata)
+        if categorical:
+            return block_majority(data, valid, factor, clcd_classes)[0]
+        return block_mean(data, valid, factor)
+
+    build_stack(var, paths, read_coarse, settings)
+
+with open_raster(ndvi_paths[0]) as src:
+    grid_transform, grid_crs, grid_shape = src.transform, src.crs, src.shape
+
+# ===============================
+# One scenario: 2_1 EcoIndex, 3_1 trends and 3_2 attribution on a region/year window
+# ===============================
+def save(path, array, transform, encoding=None):
+    profile = {'height': array.shape[0], 'width': array.shape[1], 'crs': grid_crs, 'transform': transform}
+    write_product(path, array, profile, encoding=encoding if storage_format == 'scaled' else None)
+
+def region_window(shapefile):
+    """Region mask cropped to its bounding box, widened to whole driver blocks."""
+    region = rasterio.features.geometry_mask(gpd.read_file(shapefile).geometry.values, out_shape=grid_shape,
+                                             transform=grid_transform, invert=True)
+    rows, cols = np.where(region.any(axis=1))[0], np.where(region.any(axis=0))[0]
+    if rows.size == 0:
+        return None
+    r0, c0 = rows[0] // factor * factor, cols[0] // factor * factor
+    r1 = min(-(-(rows[-1] + 1) // factor) * factor, grid_shape[0])
+    c1 = min(-(-(cols[-1] + 1) // factor) * factor, grid_shape[1])
+    return (r0, r1, c0, c1), region[r0:r1, c0:c1]
+
+def run_scenario(name, shapefile, first_year, last_year, params):
+    start = time.perf_counter()
+    out_dir = os.path.join(scenario_root, name)
+    os.makedirs(os.path.join(out_dir, 'EcoIndex'), exist_ok=True)
+
+    cropped = region_window(shapefile)
+    if cropped is None:
+        return name, 'empty region'
+    (r0, r1, c0, c1), region = cropped
+    t0, t1 = all_years.index(first_year), all_years.index(last_year) + 1
+    years = np.array(all_years[t0:t1])
+    transform = grid_transform * Affine.translation(c0, r0)
+
+    # ---------- EcoIndex (2_1): normalization and PCA fitted on this scenario's pixels ----------
+    ndvi = np.array(np.load(stack_file('NDVI'), mmap_mode='r')[t0:t1, r0:r1, c0:c1])
+    wue = np.array(np.load(stack_file('WUE'), mmap_mode='r')[t0:t1, r0:r1, c0:c1])
+    data_valid = ~np.isnan(ndvi) & ~np.isnan(wue) & region[np.newaxis]
+    valid_mask = data_valid & (ndvi > 0) & (wue > 0)
+    if not valid_mask.any():
+        return name, 'no valid pixels'
+
+    ndvi_norm = (ndvi - ndvi[valid_mask].mean()) / ndvi[valid_mask].std()
+    wue_norm = (wue - wue[valid_mask].mean()) / wue[valid_mask].std()
+    pca = PCA(n_components=1).fit(np.vstack([ndvi_norm[valid_mask], wue_norm[valid_mask]]).T)
+    coeff_ndvi, coeff_wue = pca.components_[0]
+
+    ecoindex = np.full(ndvi.shape, np.nan, dtype=np.float32)
+    ecoindex[data_valid] = coeff_ndvi * ndvi_norm[data_valid] + coeff_wue * wue_norm[data_valid]
+    del ndvi, wue, ndvi_norm, wue_norm
+    for t, year in enumerate(years):
+        save(os.path.join(out_dir, 'EcoIndex', f"{year}_EcoIndex.tif"), ecoindex[t], transform, 'EcoIndex')
+
+    # ---------- Trends (3_1): vectorized Sen's slope, Mann-Kendall and Pettitt ----------
+    slope, lower, upper, change_year, change_p = block_trends(ecoindex, years, block_rows=block_rows,
+                                                              alpha=slope_ci_alpha)
+    layers = {'SenSlope': slope, 'SenSlope_Lower': lower, 'SenSlope_Upper': upper,
+              'ChangeYear': change_year, 'Change_pvalue': change_p}
+    layers['MK_pvalue'] = mk_pvalue(*mk_state(ecoindex))
+
+    encodings = {'SenSlope': 'EcoIndex_SenSlope', 'SenSlope_Lower': 'EcoIndex_SenSlope',
+                 'SenSlope_Upper': 'EcoIndex_SenSlope', 'ChangeYear': 'year',
+                 'Change_pvalue': 'pvalue', 'MK_pvalue': 'pvalue'}
+    for key, array in layers.items():
+        save(os.path.join(out_dir, f"EcoIndex_{key}.tif"), array, transform, encodings[key])
+
+    # ---------- Attribution (3_2): anomalies over this year window on the driver grid ----------
+    eco_coarse = np.stack([block_mean(layer, ~np.isnan(layer), factor) for layer in ecoindex])
+    eco_anomaly = calc_anomalies(eco_coarse)
+    cr0, cr1, cc0, cc1 = r0 // factor, r0 // factor + eco_coarse.shape[1], c0 // factor, c0 // factor + eco_coarse.shape[2]
+    features = build_feature_cube([
+        calc_anomalies(np.array(np.load(stack_file(var), mmap_mode='r')[t0:t1, cr0:cr1, cc0:cc1]),
+                       categorical=(var == 'CLCD'))
+        for var in driver_mapping
+    ])
+
+    rf_params = dict(RF_PARAMS, max_depth=params['max_depth'])
+    if params['attribution_mode'] in ('tile', 'window'):
+        halo = params['window_halo'] if params['attribution_mode'] == 'window' else 0
+        importance = pooled_attribution(eco_anomaly, features, params['tile_size'], halo, params['min_valid_years'],
+                                        n_jobs=1, rf_params=rf_params, show_progress=False)
+    else:
+        importance = pixel_attribution(eco_anomaly, features, params['min_valid_years'], n_jobs=1,
+                                       rf_params=rf_params, show_progress=False)
+
+    coarse_transform = transform * Affine.scale(factor)
+    for idx, var in enumerate(driver_mapping):
+        save(os.path.join(out_dir, f"{var}_importance_fast.tif"), importance[:, :, idx], coarse_transform, 'importance')
+    dominance = classify_dominance(importance, params['dominance_threshold'])
+    profile = {'driver': 'GTiff', 'height': dominance.shape[0], 'width': dominance.shape[1], 'count': 1,
+               'dtype': 'uint8', 'nodata': 0, 'crs': grid_crs, 'transform': coarse_transform}
+    with rasterio.open(os.path.join(out_dir, "Driver_Dominance_fast.tif"), 'w', **profile) as dst:
+        dst.write(dominance, 1)
+
+    elapsed = time.perf_counter() - start
+    with open(os.path.join(out_dir, 'scenario.json'), 'w') as f:
+        json.dump({'region': shapefile, 'years': [first_year, last_year], 'parameters': params,
+                   'pca_coefficients': {'NDVI': float(coeff_ndvi), 'WUE': float(coeff_wue)},
+                   'window': [int(r0), int(r1), int(c0), int(c1)], 'seconds': round(elapsed, 1)}, f, indent=2)
+    return name, f"{elapsed:.1f} s"
+
+# ===============================
+# Run all scenarios in parallel
+# ===============================
+scenarios = [
+    (f"{region}_{span}_{set_name}", shapefile, first, last, params)
+    for region, shapefile in regions.items()
+    for span, (first, last) in year_ranges.items()
+    for set_name, params in parameter_sets.items()
+]
+
+results = Parallel(n_jobs=scenario_jobs)(delayed(run_scenario)(*scenario) for scenario in scenarios)
+for name, status in results:
+    print(f"🧪 {name}: {status}")
+
+print(f"✅ {len(scenarios)} scenarios evaluated. Output directory: {scenario_root}")
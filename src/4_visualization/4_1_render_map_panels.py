@@ -0,0 +1,159 @@
+import os
+os.environ['MPLBACKEND'] = 'Agg'  # Headless rendering, also inherited by worker processes
+import time
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.colors import ListedColormap, BoundaryNorm, Normalize
+from matplotlib.patches import Patch
+from joblib import Parallel, delayed
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.scaled_raster import decode_band
+from common.preview import preview_paths
+
+# ==========================================
+# Define input/output paths (customize here)
+# ==========================================
+ecoindex_dir = r"D:\your_project\results\EcoIndex_PCA"
+esi_dir = r"D:\your_project\results\ESI"
+quadrant_dir = r"D:\your_project\results\quadrant_classification"
+trend_dir = r"D:\your_project\results\TrendMaps"
+output_dir = r"D:\your_project\results\figures"
+
+ecoindex_dir, esi_dir, quadrant_dir, trend_dir, output_dir = preview_paths(
+    ecoindex_dir, esi_dir, quadrant_dir, trend_dir, output=output_dir)
+os.makedirs(output_dir, exist_ok=True)
+
+# ==========================================
+# Rendering configuration
+# ==========================================
+dpi = 200
+panel_width_in = 3.0    # Each panel is read at about panel_width_in * dpi pixels wide
+panel_height_in = 2.4
+n_jobs = -1             # Worker processes for panel rendering
+
+quadrant_colors = ['#1a9850', '#4575b4', '#d73027', '#fdae61']
+quadrant_labels = ['I (+ΔWUE, +ΔNDVI)', 'II (-ΔWUE, +ΔNDVI)', 'III (-ΔWUE, -ΔNDVI)', 'IV (+ΔWUE, -ΔNDVI)']
+
+figures = {
+    'Quadrant_2001_2023': {
+        'panels': [(str(y), os.path.join(quadrant_dir, f"{y}_Quadrant.tif")) for y in range(2001, 2024)],
+        'categorical': True, 'ncols': 6
+    },
+    'EcoIndex_2000_2023': {
+        'panels': [(str(y), os.path.join(ecoindex_dir, f"{y}_EcoIndex.tif")) for y in range(2000, 2024)],
+        'cmap': 'RdYlGn', 'vmin': -3, 'vmax': 3, 'label': 'EcoIndex', 'ncols': 6
+    },
+    'ESI_2000_2023': {
+        'panels': [(str(y), os.path.join(esi_dir, f"{y}_ESI.tif")) for y in range(2000, 2024)],
+        'cmap': 'viridis', 'vmin': 0, 'vmax': 0.7, 'label': 'ESI', 'ncols': 6
+    },
+    'Trend_SenSlope': {
+        'panels': [('EcoIndex', os.path.join(trend_dir, 'EcoIndex_SenSlope.tif')),
+                   ('ESI', os.path.join(trend_dir, 'ESI_SenSlope.tif'))],
+        'cmap': 'RdBu', 'vmin': None, 'vmax': None, 'label': "Sen's slope (yr⁻¹)", 'ncols': 2
+    },
+    'Trend_MK_pvalue': {
+        'panels': [('EcoIndex', os.path.join(trend_dir, 'EcoIndex_MK_pvalue.tif')),
+                   ('ESI', os.path.join(trend_dir, 'ESI_MK_pvalue.tif'))],
+        'cmap': 'magma_r', 'vmin': 0, 'vmax': 0.1, 'label': 'Mann–Kendall p-value', 'ncols': 2
+    }
+}
+
+# ==========================================
+# Read a decimated view sized to the output DPI
+# ==========================================
+def read_overview(path, target_width, categorical=False):
+    """
+    Read band 1 at roughly target_width pixels wide. With a reduced out_shape
+    GDAL serves the read from the closest internal/external overview level
+    when one exists, so full-resolution arrays are never decoded.
+    """
+    with rasterio.open(path) as src:
+        decim = max(1, src.width // target_width)
+        out_shape = (max(1, src.height // decim), max(1, src.width // decim))
+        data = decode_band(src, src.read(
+            1,
+            out_shape=out_shape,
+            resampling=Resampling.nearest if categorical else Resampling.average,
+            masked=True
+        ))
+    data = data.astype(np.float32).filled(np.nan)
+    if categorical:
+        data[data == 0] = np.nan  # 0 is the quadrant nodata class
+    return data
+
+# ==========================================
+# Render one panel to an RGBA image (runs in a worker)
+# ==========================================
+def render_panel(title, path, spec):
+    target_width = int(panel_width_in * dpi)
+    data = read_overview(path, target_width, categorical=spec.get('categorical', False))
+
+    if spec.get('categorical', False):
+        cmap = ListedColormap(quadrant_colors)
+        norm = BoundaryNorm([0.5, 1.5, 2.5, 3.5, 4.5], cmap.N)
+    else:
+        cmap = plt.get_cmap(spec['cmap']).copy()
+        vmin, vmax = spec.get('vmin'), spec.get('vmax')
+        if vmin is None or vmax is None:
+            # Symmetric per-panel limits; the range is shown in the panel title
+            bound = float(np.nanpercentile(np.abs(data), 98)) if np.isfinite(data).any() else 1.0
+            vmin, vmax = -bound, bound
+            title = f"{title} (±{bound:.3g})"
+        norm = Normalize(vmin=vmin, vmax=vmax)
+    cmap.set_bad(alpha=0)
+
+    fig = plt.figure(figsize=(panel_width_in, panel_height_in), dpi=dpi)
+    ax = fig.add_axes([0, 0, 1, 0.88])
+    ax.imshow(data, cmap=cmap, norm=norm, interpolation='nearest')
+    ax.set_axis_off()
+    fig.suptitle(title, fontname='Times New Roman', fontsize=12, fontweight='bold', y=0.97)
+    fig.canvas.draw()
+    rgba = np.asarray(fig.canvas.buffer_rgba()).copy()
+    plt.close(fig)
+    return rgba, norm
+
+# ==========================================
+# Assemble the panels into one figure
+# ==========================================
+def render_figure(name, spec):
+    start = time.perf_counter()
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(render_panel)(title, path, spec) for title, path in spec['panels']
+    )
+
+    ncols = spec['ncols']
+    nrows = -(-len(results) // ncols)
+    fig, axes = plt.subplots(nrows, ncols, figsize=(panel_width_in * ncols, panel_height_in * nrows + 0.8))
+    axes = np.atleast_1d(axes).ravel()
+    for ax in axes:
+        ax.set_axis_off()
+    for ax, (rgba, _) in zip(axes, results):
+        ax.imshow(rgba)
+
+    fig.subplots_adjust(left=0.01, right=0.99, top=0.99, bottom=0.08, wspace=0.02, hspace=0.02)
+
+    if spec.get('categorical', False):
+        handles = [Patch(facecolor=c, label=l) for c, l in zip(quadrant_colors, quadrant_labels)]
+        fig.legend(handles=handles, loc='lower center', ncol=4, frameon=False,
+                   prop={'family': 'Times New Roman', 'size': 14})
+    elif spec.get('vmin') is not None and spec.get('vmax') is not None:
+        cax = fig.add_axes([0.3, 0.03, 0.4, 0.015])
+        sm = plt.cm.ScalarMappable(norm=results[0][1], cmap=spec['cmap'])
+        cbar = fig.colorbar(sm, cax=cax, orientation='horizontal')
+        cbar.set_label(spec['label'], fontname='Times New Roman', fontsize=14)
+
+    output_path = os.path.join(output_dir, f"{name}.png")
+    fig.savefig(output_path, dpi=dpi)
+    plt.close(fig)
+    print(f"🖼️ {name}: {len(results)} panels in {time.perf_counter() - start:.1f} s -> {output_path}")
+
+for name, spec in figures.items():
+    render_figure(name, spec)
+
+print("✅ All map figures rendered.")
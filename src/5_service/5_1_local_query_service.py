@@ -0,0 +1,114 @@
+import os
+import json
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+from rasterio.errors import RasterioError
+from shapely.errors import ShapelyError
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.query import ProductQuery, yearly_products, single_product
+
+# ==========================================
+# Define product locations (customize here)
+# ==========================================
+ecoindex_dir = r"D:\your_project\results\EcoIndex_PCA"
+esi_dir = r"D:\your_project\results\ESI"
+trend_dir = r"D:\your_project\results\TrendMaps"
+attribution_dir = r"D:\project\results\Attribution_Fast"
+
+host, port = "127.0.0.1", 8765  # Local only
+tile_size = 256
+cache_bytes = 512 * 1024 ** 2
+years = range(2000, 2024)
+
+products = {
+    'EcoIndex': yearly_products(ecoindex_dir, '{year}_EcoIndex.tif', years),
+    'ESI': yearly_products(esi_dir, '{year}_ESI.tif', years),
+    'EcoIndex_SenSlope': single_product(os.path.join(trend_dir, 'EcoIndex_SenSlope.tif')),
+    'ESI_SenSlope': single_product(os.path.join(trend_dir, 'ESI_SenSlope.tif')),
+    'Dominance': single_product(os.path.join(attribution_dir, 'Driver_Dominance_fast.tif'))
+}
+for var in ['PR', 'SOIL', 'TEMP', 'NL', 'CLCD']:
+    products[f'{var}_importance'] = single_product(os.path.join(attribution_dir, f'{var}_importance_fast.tif'))
+
+# Products with no files yet are left out, so requests for them get a 400 instead of a failed open
+missing = sorted(k for k, v in products.items() if not v)
+if missing:
+    print(f"⚠️ No rasters found for {missing}; not served")
+products = {k: v for k, v in products.items() if v}
+
+query = ProductQuery(products, tile_size=tile_size, cache_bytes=cache_bytes)
+
+# ==========================================
+# HTTP endpoints
+#   GET  /products
+#   GET  /series?product=EcoIndex&x=..&y=..[&lonlat=1]
+#   GET  /window?product=EcoIndex&year=2023&bounds=minx,miny,maxx,maxy
+#   POST /zonal   {"product": "ESI", "geometry": {GeoJSON}, "years": [2020, 2021]}
+#   GET  /metrics
+# ==========================================
+def parse_year(value):
+    return None if value in (None, '', 'none') else int(value)
+
+class QueryHandler(BaseHTTPRequestHandler):
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, fn):
+        try:
+            self._send(200, fn())
+        except (KeyError, ValueError, TypeError, AttributeError, ShapelyError) as e:
+            # Missing fields, malformed JSON or numbers, and invalid GeoJSON geometries
+            self._send(400, {'error': str(e)})
+        except RasterioError as e:
+            self._send(422, {'error': str(e)})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        if url.path == '/products':
+            self._dispatch(lambda: {k: sorted(v, key=lambda y: (y is None, y)) for k, v in products.items()})
+        elif url.path == '/series':
+            self._dispatch(lambda: query.pixel_series(q['product'], float(q['x']), float(q['y']),
+                                                      lonlat=q.get('lonlat') == '1'))
+        elif url.path == '/window':
+            def window():
+                bounds = [float(v) for v in q['bounds'].split(',')]
+                data, transform = query.window(q['product'], parse_year(q.get('year')), bounds)
+                return {'transform': list(transform)[:6],
+                        'data': np.where(np.isnan(data), None, data).tolist()}
+            self._dispatch(window)
+        elif url.path == '/metrics':
+            self._dispatch(query.metrics)
+        else:
+            self._send(404, {'error': f'unknown endpoint {url.path}'})
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/zonal':
+            self._send(404, {'error': 'unknown endpoint'})
+            return
+        def zonal():
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            return query.zonal_stats(request['product'], request['geometry'], request.get('years'))
+        self._dispatch(zonal)
+
+    def log_message(self, format, *args):
+        pass  # Latency is reported through /metrics
+
+server = ThreadingHTTPServer((host, port), QueryHandler)
+print(f"🛰️ Query service listening on http://{host}:{port}")
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
+finally:
+    server.server_close()
+    query.close()
+    print("✅ Query service stopped.")
@@ -0,0 +1 @@
+"""Helpers shared by the numbered pipeline scripts."""
@@ -0,0 +1,189 @@
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from joblib import Parallel, delayed
+from tqdm import tqdm
+
+# Forest settings shared by the baseline, pixel-wise and pooled fits
+RF_PARAMS = {'n_estimators': 100, 'max_depth': 10, 'random_state': 42}
+
+# ===============================
+# Exact block aggregation (NumPy reshape-reduce)
+# ===============================
+def block_factor(scale_factor):
+    """Integer block size for scale_factor, or None if 1/scale_factor is not an integer."""
+    factor = int(round(1 / scale_factor))
+    return factor if factor >= 1 and abs(1 / scale_factor - factor) < 1e-6 else None
+
+def block_sum(data, factor):
+    """Sum over non-overlapping factor x factor blocks (edges padded with zeros)."""
+    h, w = data.shape
+    bh, bw = -(-h // factor), -(-w // factor)
+    padded = np.zeros((bh * factor, bw * factor), dtype=data.dtype)
+    padded[:h, :w] = data
+    return padded.reshape(bh, factor, bw, factor).sum(axis=(1, 3))
+
+def block_mean(data, valid, factor):
+    """Nodata-aware block mean; blocks without valid pixels become NaN."""
+    sums = block_sum(np.where(valid, data, 0).astype(np.float64), factor)
+    counts = block_sum(valid.astype(np.int32), factor)
+    mean = np.full(sums.shape, np.nan, dtype=np.float32)
+    np.divide(sums, counts, out=mean, where=counts > 0, casting='unsafe')
+    return mean
+
+def block_majority(data, valid, factor, classes):
+    """Block mode of categorical data and the per-class fraction of valid pixels."""
+    counts = np.stack([block_sum((valid & (data == c)).astype(np.int32), factor) for c in classes])
+    total = counts.sum(axis=0)
+    majority = np.asarray(classes, dtype=np.float32)[counts.argmax(axis=0)]  # Ties go to the lower class code
+    majority[total == 0] = np.nan
+    fractions = np.full(counts.shape, np.nan, dtype=np.float32)
+    np.divide(counts, total, out=fractions, where=total > 0, casting='unsafe')
+    return majority, fractions
+
+# ===============================
+# Standardized anomalies
+# ===============================
+def calc_anomalies(stack, categorical=False):
+    if categorical:
+        return stack
+    mean = np.nanmean(stack, axis=0)
+    std = np.nanstd(stack, axis=0)
+    return (stack - mean) / (std + 1e-6)
+
+# ===============================
+# Feature cube and training samples
+# ===============================
+def build_feature_cube(driver_cubes, path=None):
+    """
+    Stack per-driver (years, h, w) anomaly cubes into one (years, h, w, drivers)
+    float32 cube. With path the cube is a memory-mapped .npy filled one driver-year
+    at a time and returned opened read-only, so the drivers never sit in RAM together.
+    """
+    if path is None:
+        return np.stack([np.asarray(cube, dtype=np.float32) for cube in driver_cubes], axis=-1)
+    features = None
+    for k, cube in enumerate(driver_cubes):
+        if features is None:
+            features = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32,
+                                                 shape=cube.shape + (len(driver_cubes),))
+        for t in range(cube.shape[0]):
+            features[t, ..., k] = cube[t]
+    features.flush()
+    del features
+    return np.load(path, mmap_mode='r')
+
+def valid_years(eco_anomaly, features):
+    """(years, h, w) mask of years where the target and every driver are present (built year by year)."""
+    valid = np.empty(eco_anomaly.shape, dtype=bool)
+    for t in range(eco_anomaly.shape[0]):
+        valid[t] = ~np.isnan(eco_anomaly[t]) & ~np.isnan(features[t]).any(axis=-1)
+    return valid
+
+def sample_training_rows(eco_anomaly, features, sample_size=20000, min_valid_years=10, strata=None, seed=42):
+    """
+    Draw sample_size pixels with at least min_valid_years valid years and return
+    all their valid pixel-years as (X, y). With strata (an (h, w) integer label
+    map, 0 = unlabelled) the sample is split evenly across the labels, so small
+    regions or land-cover classes are represented.
+    """
+    n_years = eco_anomaly.shape[0]
+    valid = valid_years(eco_anomaly, features).reshape(n_years, -1)
+    eligible = np.flatnonzero(valid.sum(axis=0) >= min_valid_years)
+    rng = np.random.default_rng(seed)
+
+    if strata is None:
+        chosen = rng.choice(eligible, size=min(sample_size, eligible.size), replace=False)
+    else:
+        labels = strata.ravel()[eligible]
+        classes = np.unique(labels[labels > 0])
+        per_class = sample_size // max(len(classes), 1)
+        chosen = np.concatenate([
+            rng.choice(members, size=min(per_class, members.size), replace=False)
+            for members in (eligible[labels == c] for c in classes)
+        ] or [np.empty(0, dtype=np.int64)])
+
+    y = eco_anomaly.reshape(n_years, -1)[:, chosen]
+    X = features.reshape(n_years, -1, features.shape[-1])[:, chosen]
+    rows = valid[:, chosen]
+    return X[rows], y[rows]
+
+# ===============================
+# Spatially pooled attribution (one forest per tile / neighbourhood)
+# ===============================
+def fit_pooled(y_cube, x_cube, core, min_valid_years=10, rf_params=None):
+    """
+    Fit one forest on the pooled anomaly series of all eligible pixels in a window.
+    y_cube: (years, h, w); x_cube: (years, h, w, drivers); core: slices of the
+    pixels that receive the importances. Returns (importances, core_eligible) or None.
+    """
+    valid = valid_years(y_cube, x_cube)
+    eligible = valid.sum(axis=0) >= min_valid_years
+    core_eligible = eligible[core]
+    if not core_eligible.any():
+        return None
+    sample = valid & eligible[np.newaxis]
+    rf_tile = RandomForestRegressor(**(rf_params or RF_PARAMS), n_jobs=1)
+    rf_tile.fit(x_cube[sample], y_cube[sample])
+    return rf_tile.feature_importances_, core_eligible
+
+def pooled_tasks(eco_anomaly, features, tile_size, halo):
+    height, width = eco_anomaly.shape[1:]
+    for r0 in range(0, height, tile_size):
+        for c0 in range(0, width, tile_size):
+            r1, c1 = min(r0 + tile_size, height), min(c0 + tile_size, width)
+            wr0, wc0 = max(r0 - halo, 0), max(c0 - halo, 0)
+            wr1, wc1 = min(r1 + halo, height), min(c1 + halo, width)
+            rows, cols = slice(wr0, wr1), slice(wc0, wc1)
+            y_cube = eco_anomaly[:, rows, cols]
+            if np.isnan(y_cube).all():
+                continue
+            core = (slice(r0 - wr0, r1 - wr0), slice(c0 - wc0, c1 - wc0))
+            yield (r0, r1, c0, c1), (y_cube, features[:, rows, cols], core)
+
+def pooled_attribution(eco_anomaly, features, tile_size=5, halo=0, min_valid_years=10,
+                       n_jobs=-1, rf_params=None, show_progress=True):
+    height, width = eco_anomaly.shape[1:]
+    importance = np.full((height, width, features.shape[-1]), np.nan, dtype=np.float32)
+    tasks = list(pooled_tasks(eco_anomaly, features, tile_size, halo))
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(fit_pooled)(*args, min_valid_years=min_valid_years, rf_params=rf_params)
+        for _, args in tqdm(tasks, desc="Pooled Attribution", disable=not show_progress)
+    )
+    for ((r0, r1, c0, c1), _), result in zip(tasks, results):
+        if result is None:
+            continue
+        feature_importances, core_eligible = result
+        importance[r0:r1, c0:c1][core_eligible] = feature_importances
+    return importance
+
+# ===============================
+# Attribution: pixel-wise feature importance
+# ===============================
+def pixel_attribution(eco_anomaly, features, min_valid_years=10, n_jobs=-1, rf_params=None, show_progress=True):
+    """One forest per eligible pixel; eligibility and the per-pixel series come from array indexing."""
+    height, width = eco_anomaly.shape[1:]
+    importance_array = np.full((height, width, features.shape[-1]), np.nan, dtype=np.float32)
+    valid = valid_years(eco_anomaly, features)
+    eligible = np.argwhere(valid.sum(axis=0) >= min_valid_years)
+
+    for i, j in tqdm(eligible, desc="Pixel-wise Attribution", disable=not show_progress):
+        rows = valid[:, i, j]
+        rf_pixel = RandomForestRegressor(**(rf_params or RF_PARAMS), n_jobs=n_jobs)
+        rf_pixel.fit(features[rows, i, j], eco_anomaly[rows, i, j])
+        importance_array[i, j, :] = rf_pixel.feature_importances_
+    return importance_array
+
+# ===============================
+# Generate driver dominance classification
+# ===============================
+def classify_dominance(importance_array, threshold=0.05):
+    """
+    1 = climate-dominated (PR, SOIL, TEMP), 2 = human-dominated (NL, CLCD),
+    3 = mixed (score difference within threshold), 0 = no importances.
+    """
+    climate_score = importance_array[..., 0:3].sum(axis=-1)
+    human_score = importance_array[..., 3:5].sum(axis=-1)
+    dominance_map = np.where(np.abs(climate_score - human_score) <= threshold, 3,
+                             np.where(climate_score > human_score, 1, 2)).astype('uint8')
+    dominance_map[np.isnan(importance_array).all(axis=-1)] = 0
+    return dominance_map
@@ -0,0 +1,8 @@
+import os
+
+
+def driver_path(folder, keyword, year):
+    """Path of a yearly driver raster; Nightlight and CLCD names put the keyword before the year."""
+    if keyword in ['Nightlight', 'CLCD']:
+        return os.path.join(folder, f"{keyword}_{year}.tif_remove.tif")
+    return os.path.join(folder, f"{year}_{keyword}.tif_remove.tif")
@@ -0,0 +1,58 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Prefetcher:
+    """
+    Iterate over read_fn(item) for items in order while the next `depth` items
+    are read on a thread pool (rasterio releases the GIL during I/O and decoding).
+    At most depth results are buffered ahead of the consumer, which bounds memory.
+
+    overlap_ratio is the share of total read time hidden behind the consumer's
+    own work: 1.0 means the consumer never waited, 0.0 means fully serial.
+    """
+
+    def __init__(self, items, read_fn, depth=3, workers=None, label='Prefetch'):
+        self.items = items
+        self.read_fn = read_fn
+        self.depth = max(1, depth)
+        self.workers = workers or self.depth
+        self.label = label
+        self.read_time = 0.0
+        self.wait_time = 0.0
+        self._lock = threading.Lock()
+
+    def _timed_read(self, item):
+        start = time.perf_counter()
+        result = self.read_fn(item)
+        with self._lock:
+            self.read_time += time.perf_counter() - start
+        return result
+
+    def __iter__(self):
+        items = iter(self.items)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = deque(pool.submit(self._timed_read, item) for _, item in zip(range(self.depth), items))
+            while pending:
+                start = time.perf_counter()
+                result = pending.popleft().result()
+                self.wait_time += time.perf_counter() - start
+                for item in items:
+                    pending.append(pool.submit(self._timed_read, item))
+                    break
+                yield result
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def overlap_ratio(self):
+        if self.read_time <= 0:
+            return 0.0
+        return min(1.0, max(0.0, 1 - self.wait_time / self.read_time))
+
+    def report(self):
+        print(f"⏱️ {self.label}: read {self.read_time:.1f} s, waited {self.wait_time:.1f} s, "
+              f"overlap {self.overlap_ratio:.0%}")
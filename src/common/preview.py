@@ -0,0 +1,105 @@
+import os
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import Affine
+from rasterio.vrt import WarpedVRT
+
+# ==========================================
+# Preview mode: ECOINDEX_PREVIEW=<factor> runs a stage on rasters decimated by
+# that factor and writes to "<output>_preview<factor>x" folders
+# ==========================================
+PREVIEW_FACTOR = max(1, int(os.environ.get('ECOINDEX_PREVIEW', '1') or 1))
+PREVIEW_TAG = f"_preview{PREVIEW_FACTOR}x"
+
+
+def preview_enabled():
+    return PREVIEW_FACTOR > 1
+
+
+def preview_dir(folder):
+    """Tagged output folder in preview mode, the folder itself otherwise."""
+    if not preview_enabled():
+        return folder
+    return os.path.normpath(folder) + PREVIEW_TAG
+
+
+def preview_input(folder):
+    """Read an upstream stage's preview outputs when they exist, else its full outputs."""
+    tagged = preview_dir(folder)
+    return tagged if os.path.isdir(tagged) else folder
+
+
+def preview_paths(*inputs, output):
+    """preview_input of each input folder followed by preview_dir of output, in order."""
+    return tuple(preview_input(folder) for folder in inputs) + (preview_dir(output),)
+
+
+def preview_file(path):
+    """Tag a cache or side file name (e.g. a validity mask) so preview and full runs never share it."""
+    if not preview_enabled():
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}{PREVIEW_TAG}{ext}"
+
+
+class PreviewRaster(WarpedVRT):
+    """
+    A decimated read-only view of a raster. It behaves like the opened source
+    (meta, profile, scales/offsets, nodata) on the coarser grid; GDAL reads
+    from the closest overview level when the file has one.
+    """
+
+    def _grid_profile(self, profile):
+        profile = dict(profile)
+        profile.update(height=self.height, width=self.width, transform=self.transform)
+        return profile
+
+    @property
+    def meta(self):
+        return self._grid_profile(self.src_dataset.meta)
+
+    @property
+    def profile(self):
+        return self._grid_profile(self.src_dataset.profile)
+
+    @property
+    def scales(self):
+        return self.src_dataset.scales
+
+    @property
+    def offsets(self):
+        return self.src_dataset.offsets
+
+    def tags(self, *args, **kwargs):
+        return self.src_dataset.tags(*args, **kwargs)
+
+    def close(self):
+        super().close()
+        self.src_dataset.close()
+
+
+def open_raster(path, categorical=None):
+    """
+    Open a raster for reading, decimated by PREVIEW_FACTOR in preview mode.
+    Files already inside a preview folder are opened as they are. Categorical
+    rasters (by default: unscaled integer bands) use nearest-neighbour
+    resampling, everything else the nodata-aware average.
+    """
+    src = rasterio.open(path)
+    if not preview_enabled() or PREVIEW_TAG in path:
+        return src
+
+    if categorical is None:
+        categorical = (np.issubdtype(np.dtype(src.dtypes[0]), np.integer)
+                       and src.scales[0] == 1 and src.offsets[0] == 0)
+    width = max(1, src.width // PREVIEW_FACTOR)
+    height = max(1, src.height // PREVIEW_FACTOR)
+    return PreviewRaster(
+        src,
+        crs=src.crs,
+        width=width,
+        height=height,
+        transform=src.transform * Affine.scale(src.width / width, src.height / height),
+        resampling=Resampling.nearest if categorical else Resampling.average
+    )
@@ -0,0 +1,224 @@
+import os
+import math
+import threading
+import time
+from collections import OrderedDict, defaultdict
+import numpy as np
+import rasterio
+import rasterio.features
+import rasterio.windows
+from rasterio.warp import transform as warp_transform
+from shapely.geometry import shape
+
+from common.scaled_raster import decode_band, is_scaled
+from common.validity import valid_pixels
+
+
+class DatasetPool:
+    """Lazily opened rasterio datasets, closing the least recently used beyond max_open."""
+
+    def __init__(self, max_open=64):
+        self.max_open = max_open
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        with self._lock:
+            if path in self._open:
+                self._open.move_to_end(path)
+                return self._open[path]
+            src = rasterio.open(path)
+            self._open[path] = src
+            if len(self._open) > self.max_open:
+                _, oldest = self._open.popitem(last=False)
+                oldest.close()
+            return src
+
+    def close(self):
+        with self._lock:
+            for src in self._open.values():
+                src.close()
+            self._open.clear()
+
+
+class TileCache:
+    """LRU cache of decoded float32 tiles (NaN = invalid), bounded by total bytes."""
+
+    def __init__(self, pool, tile_size=256, max_bytes=512 * 1024 ** 2):
+        self.pool = pool
+        self.tile_size = tile_size
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._tiles = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()  # A rasterio dataset must not be read concurrently
+
+    def tile(self, path, tile_row, tile_col):
+        key = (path, tile_row, tile_col)
+        with self._lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                self.hits += 1
+                return self._tiles[key]
+            self.misses += 1
+
+        with self._read_lock:
+            src = self.pool.get(path)
+            ts = self.tile_size
+            window = rasterio.windows.Window(tile_col * ts, tile_row * ts,
+                                             min(ts, src.width - tile_col * ts), min(ts, src.height - tile_row * ts))
+            data = decode_band(src, src.read(1, window=window)).astype(np.float32)
+            data[~valid_pixels(data, None if is_scaled(src) else src.nodata)] = np.nan
+
+        with self._lock:
+            if key not in self._tiles:
+                self._tiles[key] = data
+                self._bytes += data.nbytes
+                while self._bytes > self.max_bytes and len(self._tiles) > 1:
+                    _, old = self._tiles.popitem(last=False)
+                    self._bytes -= old.nbytes
+        return data
+
+    def region(self, path, row0, row1, col0, col1):
+        """Stitch the decoded tiles covering rows [row0, row1) and cols [col0, col1)."""
+        ts = self.tile_size
+        out = np.full((row1 - row0, col1 - col0), np.nan, dtype=np.float32)
+        for tr in range(row0 // ts, (row1 - 1) // ts + 1):
+            for tc in range(col0 // ts, (col1 - 1) // ts + 1):
+                tile = self.tile(path, tr, tc)
+                r0, c0 = max(row0, tr * ts), max(col0, tc * ts)
+                r1, c1 = min(row1, tr * ts + tile.shape[0]), min(col1, tc * ts + tile.shape[1])
+                out[r0 - row0:r1 - row0, c0 - col0:c1 - col0] = tile[r0 - tr * ts:r1 - tr * ts, c0 - tc * ts:c1 - tc * ts]
+        return out
+
+
+class ProductQuery:
+    """
+    In-process query API over the derived products.
+
+    products maps a name to {year: path} (yearly series such as EcoIndex or ESI)
+    or to {None: path} (single rasters such as importance or trend maps).
+    Coordinates are in the raster CRS unless lonlat=True.
+    """
+
+    def __init__(self, products, tile_size=256, cache_bytes=512 * 1024 ** 2, max_open=64):
+        self.products = products
+        self.pool = DatasetPool(max_open)
+        self.cache = TileCache(self.pool, tile_size, cache_bytes)
+        self._latency = defaultdict(list)
+        self._lock = threading.Lock()
+
+    # ---------- helpers ----------
+    def _timed(self, name, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._latency[name].append(time.perf_counter() - start)
+
+    def _layers(self, product, years=None):
+        layers = self.products[product]
+        return [(y, p) for y, p in sorted(layers.items(), key=lambda kv: (kv[0] is None, kv[0]))
+                if years is None or y in years]
+
+    def _to_dataset_xy(self, src, x, y, lonlat):
+        if lonlat:
+            xs, ys = warp_transform('EPSG:4326', src.crs, [x], [y])
+            return xs[0], ys[0]
+        return x, y
+
+    # ---------- queries ----------
+    def pixel_series(self, product, x, y, lonlat=False):
+        return self._timed('pixel_series', self._pixel_series, product, x, y, lonlat)
+
+    def _pixel_series(self, product, x, y, lonlat):
+        series = []
+        for year, path in self._layers(product):
+            src = self.pool.get(path)
+            px, py = self._to_dataset_xy(src, x, y, lonlat)
+            row, col = src.index(px, py)
+            value = np.nan
+            if 0 <= row < src.height and 0 <= col < src.width:
+                ts = self.cache.tile_size
+                value = float(self.cache.tile(path, row // ts, col // ts)[row % ts, col % ts])
+            series.append({'year': year, 'value': None if np.isnan(value) else value})
+        return series
+
+    def window(self, product, year, bounds):
+        return self._timed('window', self._window, product, year, bounds)
+
+    def _covering_window(self, src, bounds):
+        """
+        Integer window of every pixel touched by bounds (floor of the start, ceil of
+        the end), clipped to the dataset. Returns (window, transform); window is None
+        when bounds miss the raster, and transform is then that of the requested area.
+        """
+        win = rasterio.windows.from_bounds(*bounds, transform=src.transform)
+        row0, col0 = max(math.floor(win.row_off), 0), max(math.floor(win.col_off), 0)
+        row1 = min(math.ceil(win.row_off + win.height), src.height)
+        col1 = min(math.ceil(win.col_off + win.width), src.width)
+        if row0 >= row1 or col0 >= col1:
+            return None, rasterio.windows.transform(win, src.transform)
+        win = rasterio.windows.Window(col0, row0, col1 - col0, row1 - row0)
+        return win, rasterio.windows.transform(win, src.transform)
+
+    def _window(self, product, year, bounds):
+        path = self.products[product][year]
+        src = self.pool.get(path)
+        win, transform = self._covering_window(src, bounds)
+        if win is None:
+            return np.empty((0, 0), dtype=np.float32), transform
+        data = self.cache.region(path, win.row_off, win.row_off + win.height, win.col_off, win.col_off + win.width)
+        return data, transform
+
+    def zonal_stats(self, product, geometry, years=None):
+        return self._timed('zonal_stats', self._zonal_stats, product, geometry, years)
+
+    def _zonal_stats(self, product, geometry, years):
+        geom = shape(geometry)
+        results = []
+        for year, path in self._layers(product, years):
+            src = self.pool.get(path)
+            win, transform = self._covering_window(src, geom.bounds)
+            if win is None:
+                results.append({'year': year, 'count': 0})
+                continue
+            data = self.cache.region(path, win.row_off, win.row_off + win.height, win.col_off, win.col_off + win.width)
+            inside = rasterio.features.geometry_mask([geom], out_shape=data.shape, invert=True, transform=transform)
+            values = data[inside & ~np.isnan(data)]
+            stats = {'year': year, 'count': int(values.size)}
+            if values.size:
+                stats.update(mean=float(values.mean()), median=float(np.median(values)),
+                             min=float(values.min()), max=float(values.max()), std=float(values.std()))
+            results.append(stats)
+        return results
+
+    def metrics(self):
+        with self._lock:
+            latency = {
+                name: {'count': len(v), 'p50_ms': float(np.percentile(v, 50) * 1e3),
+                       'p95_ms': float(np.percentile(v, 95) * 1e3)}
+                for name, v in self._latency.items() if v
+            }
+        total = self.cache.hits + self.cache.misses
+        return {'latency': latency,
+                'tile_cache': {'hits': self.cache.hits, 'misses': self.cache.misses,
+                               'hit_ratio': self.cache.hits / total if total else 0.0,
+                               'bytes': self.cache._bytes}}
+
+    def close(self):
+        self.pool.close()
+
+
+def yearly_products(folder, pattern, years):
+    """{year: path} for the yearly files that exist."""
+    layers = {y: os.path.join(folder, pattern.format(year=y)) for y in years}
+    return {y: p for y, p in layers.items() if os.path.exists(p)}
+
+
+def single_product(path):
+    """{None: path} for a single raster, or {} if it has not been produced yet."""
+    return {None: path} if os.path.exists(path) else {}
@@ -0,0 +1,92 @@
+import numpy as np
+import rasterio
+
+# ==========================================
+# Scaled-integer encodings: name -> (dtype, scale, offset)
+# value = stored * scale + offset; the reserved code marks nodata
+# ==========================================
+SCALED_ENCODINGS = {
+    'EcoIndex': ('int16', 1e-3, 0.0),            # ±32.767
+    'ESI': ('uint16', 2e-5, 0.0),                # 0 .. 1.31
+    'EcoIndex_SenSlope': ('int16', 2e-5, 0.0),   # ±0.655 per year
+    'ESI_SenSlope': ('int16', 2.5e-5, 0.0),      # ±0.819 per year (ESI spans 0 .. 0.707)
+    'pvalue': ('uint16', 1 / 65534, 0.0),        # 0 .. 1
+    'importance': ('uint16', 1 / 65534, 0.0),    # 0 .. 1
+    'year': ('int16', 1.0, 2000.0)               # Calendar year stored as offset from 2000
+}
+
+NODATA_CODES = {'int16': -32768, 'uint16': 65535}
+
+
+def encode_scaled(array, encoding, nodata=np.nan):
+    """Quantize a float array to the given encoding; NaN and nodata map to the reserved code."""
+    dtype, scale, offset = SCALED_ENCODINGS[encoding]
+    info = np.iinfo(dtype)
+    code = NODATA_CODES[dtype]
+    lo, hi = (info.min + 1, info.max) if code == info.min else (info.min, info.max - 1)
+
+    missing = ~np.isfinite(array)
+    if nodata is not None and not np.isnan(nodata):
+        missing |= array == nodata
+
+    scaled = np.rint((np.where(missing, offset, array) - offset) / scale)
+    n_clipped = int(np.count_nonzero(((scaled < lo) | (scaled > hi)) & ~missing))
+    if n_clipped:
+        print(f"⚠️ {n_clipped} values outside the {encoding} storage range were clipped.")
+    encoded = np.clip(scaled, lo, hi).astype(dtype)
+    encoded[missing] = code
+    return encoded
+
+
+def open_product(path, profile, encoding=None, nodata=np.nan):
+    """
+    Open a single-band product for writing. Without an encoding the band is
+    float32; with one it holds scaled integers plus GDAL scale/offset metadata,
+    so both decode_band and GIS software recover the physical values.
+    """
+    profile = dict(profile)
+    profile.update({'driver': 'GTiff', 'count': 1})
+
+    if encoding is None:
+        profile.update({'dtype': 'float32', 'nodata': nodata})
+        return rasterio.open(path, 'w', **profile)
+
+    dtype, scale, offset = SCALED_ENCODINGS[encoding]
+    profile.update({'dtype': dtype, 'nodata': NODATA_CODES[dtype]})
+    dst = rasterio.open(path, 'w', **profile)
+    dst.scales = (scale,)
+    dst.offsets = (offset,)
+    dst.update_tags(1, storage_encoding=encoding)
+    return dst
+
+
+def write_window(dst, array, encoding=None, nodata=np.nan, window=None):
+    """Write array (the whole band or one window) to a dataset from open_product."""
+    if encoding is None:
+        dst.write(np.asarray(array, dtype=np.float32), 1, window=window)
+    else:
+        dst.write(encode_scaled(np.asarray(array, dtype=np.float64), encoding, nodata), 1, window=window)
+
+
+def write_product(path, array, profile, encoding=None, nodata=np.nan):
+    """Write a single-band product in one call (see open_product)."""
+    with open_product(path, profile, encoding, nodata) as dst:
+        write_window(dst, array, encoding, nodata)
+
+
+def is_scaled(src, band=1):
+    return (np.issubdtype(np.dtype(src.dtypes[band - 1]), np.integer)
+            and (src.scales[band - 1] != 1 or src.offsets[band - 1] != 0))
+
+
+def decode_band(src, data, band=1):
+    """
+    Decode data read from src (e.g. via rasterio.mask.mask) to physical values.
+    Scaled-integer bands become float32 with NaN nodata; other bands are returned unchanged.
+    """
+    if not is_scaled(src, band):
+        return data
+    decoded = data.astype(np.float32) * np.float32(src.scales[band - 1]) + np.float32(src.offsets[band - 1])
+    if src.nodata is not None:
+        decoded[data == src.nodata] = np.nan
+    return decoded
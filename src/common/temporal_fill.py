@@ -0,0 +1,59 @@
+import numpy as np
+
+FILL_METHODS = ('linear', 'nearest', 'climatology')
+
+
+def gap_neighbours(valid):
+    """
+    For a (years, pixels) validity block, the index of the previous and next
+    valid year at every position (-1 / n_years where none exists) and the
+    length of the gap each missing year belongs to.
+    """
+    n_years = valid.shape[0]
+    idx = np.arange(n_years)[:, None]
+    prev = np.maximum.accumulate(np.where(valid, idx, -1), axis=0)
+    nxt = np.minimum.accumulate(np.where(valid, idx, n_years)[::-1], axis=0)[::-1]
+
+    gap_len = nxt - prev - 1
+    gap_len = np.where(prev < 0, nxt, gap_len)                  # Leading gap
+    gap_len = np.where(nxt >= n_years, n_years - 1 - prev, gap_len)  # Trailing gap
+    return prev, nxt, gap_len
+
+
+def fill_gaps(block, method='linear', max_gap=2):
+    """
+    Fill NaN years of a (years, pixels) block along the year axis.
+
+    linear      - interpolate between the bracketing valid years (interior gaps only)
+    nearest     - copy the closest valid year (the earlier one on ties)
+    climatology - use the pixel's mean over its valid years
+
+    Only gaps of at most max_gap consecutive years are filled. Returns the
+    filled block and the number of filled years per pixel.
+    """
+    if method not in FILL_METHODS:
+        raise ValueError(f"Unknown fill method '{method}', expected one of {FILL_METHODS}.")
+
+    valid = ~np.isnan(block)
+    n_years = block.shape[0]
+    idx = np.arange(n_years)[:, None]
+    prev, nxt, gap_len = gap_neighbours(valid)
+    fill = ~valid & valid.any(axis=0) & (gap_len <= max_gap)
+
+    before = np.take_along_axis(block, np.clip(prev, 0, n_years - 1), axis=0)
+    after = np.take_along_axis(block, np.clip(nxt, 0, n_years - 1), axis=0)
+
+    if method == 'linear':
+        fill &= (prev >= 0) & (nxt < n_years)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values = before + (after - before) * (idx - prev) / (nxt - prev)
+    elif method == 'nearest':
+        use_before = (prev >= 0) & ((nxt >= n_years) | (idx - prev <= nxt - idx))
+        values = np.where(use_before, before, after)
+    else:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            climatology = np.nansum(block, axis=0) / valid.sum(axis=0)
+        values = np.broadcast_to(climatology, block.shape)
+
+    filled = np.where(fill, values, block).astype(block.dtype, copy=False)
+    return filled, fill.sum(axis=0).astype(np.int16)
@@ -0,0 +1,142 @@
+import numpy as np
+from scipy.stats import norm
+from tqdm import tqdm
+
+# ==========================================
+# Vectorized trend kernels over blocks of pixel time series.
+# A block has shape (years, pixels); NaN marks missing years.
+# ==========================================
+
+
+def pairwise_slopes(block, years):
+    """Slopes of all year pairs i < j, shape (pairs, pixels); NaN where either year is missing."""
+    i, j = np.triu_indices(block.shape[0], k=1)
+    dt = (np.asarray(years, dtype=np.float64)[j] - np.asarray(years, dtype=np.float64)[i])[:, None]
+    return (block[j] - block[i]) / dt
+
+
+def sen_slope_ci(block, years, alpha=0.05):
+    """
+    Sen's slope and its rank-based (1 - alpha) confidence bounds per pixel.
+    The bounds use the no-ties Mann-Kendall variance n(n-1)(2n+5)/18.
+    Returns (slope, lower, upper); pixels with fewer than two valid years are NaN.
+    """
+    slopes = np.sort(pairwise_slopes(block, years), axis=0)  # NaN sorts last
+    m = np.sum(~np.isnan(slopes), axis=0)
+    n = np.sum(~np.isnan(block), axis=0).astype(np.float64)
+    has = m > 0
+    last = np.maximum(m - 1, 0)
+
+    def rank(idx):
+        idx = np.clip(idx, 0, last).astype(np.intp)
+        return np.take_along_axis(slopes, idx[None, :], axis=0)[0]
+
+    slope = 0.5 * (rank((m - 1) // 2) + rank(m // 2))
+
+    c = norm.ppf(1 - alpha / 2) * np.sqrt(n * (n - 1) * (2 * n + 5) / 18)
+    lower = rank(np.rint((m - c) / 2) - 1)   # 1-based rank M1
+    upper = rank(np.rint((m + c) / 2))       # 1-based rank M2 + 1
+
+    for arr in (slope, lower, upper):
+        arr[~has] = np.nan
+    return slope, lower, upper
+
+
+def pettitt(block):
+    """
+    Pettitt change-point test per pixel. Missing years contribute no pairs.
+    Returns (index, p): index is the position of the last year before the shift,
+    p the approximate significance 2 exp(-6K^2 / (n^3 + n^2)).
+    """
+    n_years = block.shape[0]
+    v = np.empty(block.shape, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        for t in range(n_years):
+            v[t] = np.nansum(np.sign(block[t] - block), axis=0)  # NaN pairs -> 0
+    v[np.isnan(block)] = 0
+    u = np.abs(np.cumsum(v, axis=0)[:-1])
+
+    index = np.argmax(u, axis=0)
+    k = np.take_along_axis(u, index[None, :], axis=0)[0]
+    n = np.sum(~np.isnan(block), axis=0).astype(np.float64)
+
+    p = np.full(k.shape, np.nan)
+    ok = n >= 2
+    p[ok] = np.minimum(1.0, 2 * np.exp(-6 * k[ok] ** 2 / (n[ok] ** 3 + n[ok] ** 2)))
+    return index, p
+
+
+def block_trends(stack, years, block_rows=16, alpha=0.05, pixel_mask=None, desc=None):
+    """
+    Sen's slope with its (1 - alpha) bounds and the Pettitt change year and p-value
+    of a (years, h, w) stack, computed on blocks of block_rows rows. Pixels with no
+    data (or outside pixel_mask) are NaN. Returns float32 (h, w) arrays
+    (slope, lower, upper, change_year, change_p); desc shows a progress bar.
+    """
+    years = np.asarray(years)
+    n_years, height, width = stack.shape
+    slope_map, lower_map, upper_map, year_map, p_map = (
+        np.full((height, width), np.nan, dtype=np.float32) for _ in range(5))
+
+    for r0 in tqdm(range(0, height, block_rows), desc=desc, disable=desc is None):
+        r1 = min(r0 + block_rows, height)
+        block = stack[:, r0:r1].reshape(n_years, -1).astype(np.float64)
+        has_data = ~np.all(np.isnan(block), axis=0)
+        if pixel_mask is not None:
+            has_data &= pixel_mask[r0:r1].ravel()
+        if not has_data.any():
+            continue
+        block = block[:, has_data]
+
+        slope, lower, upper = sen_slope_ci(block, years, alpha=alpha)
+        index, p = pettitt(block)
+        change_year = np.where(np.isnan(p), np.nan, years[index])
+
+        for out, values in ((slope_map, slope), (lower_map, lower), (upper_map, upper),
+                            (year_map, change_year), (p_map, p)):
+            flat = np.full(has_data.shape, np.nan, dtype=np.float32)
+            flat[has_data] = values
+            out[r0:r1] = flat.reshape(r1 - r0, width)
+
+    return slope_map, lower_map, upper_map, year_map, p_map
+
+
+def mk_update(s, tie_term, n, new, history):
+    """
+    Update Mann-Kendall state in place for one appended year.
+    s: S statistic, tie_term: sum of t(t-1)(2t+5) over tie groups, n: valid-year count.
+    new is the appended layer and history iterates over the earlier layers (same shape).
+    Values equal to the new one form a single tie group of size t, which grows to t + 1.
+    """
+    valid = ~np.isnan(new)
+    ties = np.zeros(new.shape, dtype=np.int64)
+    with np.errstate(invalid='ignore'):
+        for old in history:
+            d = new - old
+            s += np.nan_to_num(np.sign(d)).astype(s.dtype)
+            ties += d == 0
+    tie_term += np.where(valid, (ties + 1) * ties * (2 * ties + 7) - ties * (ties - 1) * (2 * ties + 5), 0)
+    n += valid.astype(n.dtype)
+
+
+def mk_state(stack):
+    """Mann-Kendall state (s, tie_term, n) of a (years, ...) stack, built one year at a time."""
+    shape = stack.shape[1:]
+    s = np.zeros(shape, dtype=np.int32)
+    tie_term = np.zeros(shape, dtype=np.int64)
+    n = np.zeros(shape, dtype=np.int16)
+    for t in range(stack.shape[0]):
+        mk_update(s, tie_term, n, stack[t], stack[:t])
+    return s, tie_term, n
+
+
+def mk_pvalue(s, tie_term, n, min_years=6):
+    """Two-sided Mann-Kendall p-value from the state (same statistic as pymannkendall.original_test)."""
+    n = n.astype(np.float64)
+    var = (n * (n - 1) * (2 * n + 5) - tie_term) / 18
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sd = np.sqrt(var)
+        z = np.where(s > 0, (s - 1) / sd, np.where(s < 0, (s + 1) / sd, 0.0))
+    p = 2 * (1 - norm.cdf(np.abs(z)))
+    p[n < min_years] = np.nan
+    return p
@@ -0,0 +1,116 @@
+import os
+import hashlib
+import numpy as np
+import rasterio
+import rasterio.features
+from shapely.geometry import shape
+
+from common.scaled_raster import decode_band, is_scaled
+from common.preview import open_raster, preview_file
+
+
+def valid_pixels(data, nodata=None):
+    """
+    The pipeline-wide validity rule: a pixel is valid if it is finite, differs
+    from the raster's nodata value and is not the float fill sentinel (< -1e30).
+    """
+    with np.errstate(invalid='ignore'):
+        valid = np.isfinite(data) & (data > -1e30)
+        if nodata is not None and not np.isnan(nodata):
+            valid &= data != nodata
+    return valid
+
+
+def geometry_key(geoms):
+    """Stable digest of the region geometries (shapely or GeoJSON-like)."""
+    sha = hashlib.sha1()
+    for geom in geoms:
+        sha.update((geom if hasattr(geom, 'wkb') else shape(geom)).wkb)
+    return sha.hexdigest()
+
+
+class ValidityMask:
+    """Per-pixel-year validity of one variable, bit-packed along the pixel axis."""
+
+    def __init__(self, bits, years, shape, region_key=''):
+        self.bits = bits                  # (years, ceil(rows * cols / 8)) uint8
+        self.years = list(years)
+        self.shape = tuple(shape)
+        self.region_key = region_key
+
+    def year(self, index):
+        """Boolean (rows, cols) mask of the index-th year."""
+        n = self.shape[0] * self.shape[1]
+        return np.unpackbits(self.bits[index], count=n).view(bool).reshape(self.shape)
+
+    def rows(self, index, row_start, row_stop):
+        """Boolean (row_stop - row_start, cols) mask of one year, unpacking only those rows."""
+        cols = self.shape[1]
+        start, stop = row_start * cols, row_stop * cols
+        first_byte = start // 8
+        bits = np.unpackbits(self.bits[index, first_byte:-(-stop // 8)])
+        return bits[start - first_byte * 8:stop - first_byte * 8].view(bool).reshape(row_stop - row_start, cols)
+
+    def stack(self):
+        """Boolean (years, rows, cols) mask."""
+        n = self.shape[0] * self.shape[1]
+        return np.unpackbits(self.bits, axis=1, count=n).view(bool).reshape((len(self.years),) + self.shape)
+
+    def count(self):
+        """Number of valid years per pixel."""
+        counts = np.zeros(self.shape, dtype=np.int16)
+        for t in range(len(self.years)):
+            counts += self.year(t)
+        return counts
+
+    def save(self, path):
+        np.savez_compressed(path, bits=self.bits, years=np.array(self.years),
+                            shape=np.array(self.shape), region_key=np.array(self.region_key))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(f['bits'], f['years'].tolist(), f['shape'].tolist(), str(f['region_key']))
+
+
+def build_validity(paths, years, geoms=None):
+    """Read each yearly raster once and pack its validity (inside geoms, if given)."""
+    bits = []
+    region = None
+    for path in paths:
+        with open_raster(path) as src:
+            data = decode_band(src, src.read(1))
+            valid = valid_pixels(data, None if is_scaled(src) else src.nodata)
+            if geoms is not None:
+                if region is None:
+                    region = rasterio.features.geometry_mask(
+                        geoms, out_shape=src.shape, transform=src.transform, invert=True
+                    )
+                valid &= region
+            grid = src.shape
+        bits.append(np.packbits(valid.ravel()))
+    region_key = geometry_key(geoms) if geoms is not None else ''
+    return ValidityMask(np.stack(bits), years, grid, region_key)
+
+
+def load_or_build_validity(cache_path, paths, years, geoms=None):
+    """
+    Load the cached mask of a variable, rebuilding it when the years, the region
+    or any source raster changed since it was written. The file name carries a
+    short region digest, so masks clipped to different study areas sit side by
+    side, and preview runs use their own tagged cache file.
+    """
+    region_key = geometry_key(geoms) if geoms is not None else ''
+    if region_key:
+        base, ext = os.path.splitext(cache_path)
+        cache_path = f"{base}_{region_key[:12]}{ext}"
+    cache_path = preview_file(cache_path)
+    if os.path.exists(cache_path):
+        cached = ValidityMask.load(cache_path)
+        cache_time = os.path.getmtime(cache_path)
+        if (cached.years == list(years) and cached.region_key == region_key
+                and all(os.path.getmtime(p) <= cache_time for p in paths)):
+            return cached
+    mask = build_validity(paths, years, geoms)
+    mask.save(cache_path)
+    return mask